@@ -0,0 +1,89 @@
+"""
+Time to import the API (`import src`), from `python -X importtime`: the total, the packages that cost the most
+and which of our modules pull each third-party package in. Each run is a fresh interpreter; the best run is
+reported, the others mostly measure a cold disk cache.
+
+    python -m benchmarks.import_time --runs 5
+
+It exits with status 1 when the best run is slower than BUDGET seconds (or --budget), or when one of the LAZY
+packages, which are imported on first use, shows up; tests/test_import_time.py runs the same check.
+"""
+import argparse, re, subprocess, sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# seconds for `import src`, which takes 0.6-1.0s depending on the machine; the headroom is for slow CI runners,
+# a package that goes back to being imported eagerly is caught by the LAZY check instead
+BUDGET = 1.2
+LAZY = ("celery", "fastapi_mail", "passlib", "itsdangerous")
+
+
+def import_times(module: str) -> List[Tuple[int, str, int, int]]:
+    """(depth, module, self us, cumulative us) for every import, children listed before their parent"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    entries = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)) // 2, match.group(4), int(match.group(1)), int(match.group(2))))
+    return entries
+
+
+def total_us(entries: List[Tuple[int, str, int, int]], module: str) -> int:
+    return next(cumulative for depth, name, _, cumulative in entries if depth == 0 and name == module)
+
+
+def problems(entries: List[Tuple[int, str, int, int]], module: str, budget: float) -> List[str]:
+    found = []
+    seconds = total_us(entries, module) / 1e6
+    if seconds > budget:
+        found.append(f"import {module} took {seconds:.3f}s, over the {budget:.3f}s budget")
+    imported = {name.split(".")[0] for _, name, _, _ in entries}
+    found += [f"import {module} imports {package}, which should be imported on first use" for package in LAZY if package in imported]
+    return found
+
+
+def report(entries: List[Tuple[int, str, int, int]], module: str, top: int) -> None:
+    own = module.split(".")[0]
+    by_package: Dict[str, int] = defaultdict(int)
+    for _, name, self_us, _ in entries:
+        by_package[name.split(".")[0]] += self_us
+
+    # a third-party package imported straight from one of our modules, and what it cost there
+    pulled_in: Dict[str, Dict[str, int]] = defaultdict(dict)
+    for i, (depth, name, _, cumulative) in enumerate(entries):
+        package = name.split(".")[0]
+        if package == own:
+            continue
+        parent = next((entry for entry in entries[i + 1:] if entry[0] < depth), None)
+        if parent is not None and parent[1].split(".")[0] == own:
+            pulled_in[package][parent[1]] = pulled_in[package].get(parent[1], 0) + cumulative
+
+    print(f"import {module}: {total_us(entries, module) / 1000:.0f} ms\n")
+    print(f"{'package':24} {'self ms':>8}   imported by")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        importers = ", ".join(f"{name} ({us / 1000:.0f} ms)" for name, us in sorted(pulled_in.get(package, {}).items(), key=lambda item: -item[1])[:3])
+        print(f"{package:24} {self_us / 1000:8.1f}   {importers}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="src")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds; exit with status 1 if the best run is slower")
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda entries: total_us(entries, args.module))
+    report(best, args.module, args.top)
+
+    found = problems(best, args.module, args.budget)
+    for problem in found:
+        print(f"\n{problem}")
+    if found:
+        sys.exit(1)
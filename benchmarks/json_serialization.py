@@ -0,0 +1,81 @@
+"""
+GET /books/ serialization paths for one page of books: ORM objects revalidated through the
+response_model and rendered with the stdlib json (what FastAPI does with `response_model=List[Book]`),
+vs rows projected to dicts and rendered with orjson, vs the same rows as MessagePack (when installed).
+Each path is timed from the query to the response body, on an in-memory SQLite database.
+
+    python -m benchmarks.json_serialization --books 1000 --rounds 20
+"""
+import argparse, asyncio, time, uuid
+from datetime import datetime
+from typing import List
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.db.models import Book, LanguageEnum
+from src.responses import FastJSONResponse, MsgPackResponse, msgpack
+from src.schema import Book as BookSchema
+from src.service import BookService
+
+book_service = BookService()
+books_adapter = TypeAdapter(List[BookSchema])
+
+
+async def response_model_path(session: AsyncSession) -> bytes:
+    books = await book_service.get_all_books(session)
+    content = books_adapter.dump_python(books_adapter.validate_python(books, from_attributes=True), mode="json")
+    return JSONResponse(content).body
+
+
+async def orjson_path(session: AsyncSession) -> bytes:
+    return FastJSONResponse(await book_service.get_all_book_rows(session)).body
+
+
+async def msgpack_path(session: AsyncSession) -> bytes:
+    return MsgPackResponse(await book_service.get_all_book_rows(session)).body
+
+
+async def seed(session: AsyncSession, count: int) -> None:
+    now = datetime.now()
+    session.add_all(
+        Book(uid=str(uuid.uuid4()), title=f"Book {i}", author=f"Author {i % 50}", year=str(1950 + i % 70),
+             language=LanguageEnum.English if i % 2 else LanguageEnum.Other, created_at=now, updated_at=now)
+        for i in range(count)
+    )
+    await session.commit()
+
+
+async def run(books: int, rounds: int) -> None:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+    paths = [("response_model + json", response_model_path), ("rows + orjson", orjson_path)]
+    if msgpack is not None:
+        paths.append(("rows + msgpack", msgpack_path))
+
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        await seed(session, books)
+
+        for name, path in paths:
+            # a fresh identity map each round, as in a request
+            session.expunge_all()
+            body = await path(session)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                session.expunge_all()
+                await path(session)
+            elapsed = (time.perf_counter() - start) / rounds
+            print(f"{name:24} {elapsed * 1000:8.2f} ms/page  {len(body) / 1024:8.1f} KiB")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.books, args.rounds))
@@ -0,0 +1,99 @@
+"""
+Memory held by a large book listing: full SQLModel entities from get_all_books (with their
+selectin-loaded reviews and identity map), vs the slotted BookRow DTOs from get_all_book_rows,
+vs streaming them with iter_book_rows. Each mode runs in its own process so the peak RSS is its own:
+once with tracemalloc for the bytes retained per row, once without it for the RSS.
+
+    python -m benchmarks.listing_memory --books 100000
+"""
+import argparse, asyncio, os, resource, subprocess, sys, tempfile, time, tracemalloc, uuid
+from datetime import datetime
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.db.models import Book, LanguageEnum
+from src.service import BookService
+
+book_service = BookService()
+MODES = ("orm", "rows", "stream")
+
+
+async def seed(url: str, count: int) -> None:
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    now = datetime.now()
+    async with AsyncSession(engine) as session:
+        for start in range(0, count, 10000):
+            session.add_all(
+                Book(uid=str(uuid.uuid4()), title=f"Book {i}", author=f"Author {i % 50}", year=str(1950 + i % 70),
+                     language=LanguageEnum.English, created_at=now, updated_at=now)
+                for i in range(start, min(start + 10000, count))
+            )
+            await session.commit()
+    await engine.dispose()
+
+
+async def listing(url: str, mode: str, trace: bool) -> None:
+    engine = create_async_engine(url)
+    async with AsyncSession(engine) as session:
+        # warm up the connection and the statement caches so they are not counted
+        await book_service.get_all_book_rows(session, ["uid"])
+
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+
+        if mode == "orm":
+            rows = await book_service.get_all_books(session)
+            count = len(rows)
+        elif mode == "rows":
+            rows = await book_service.get_all_book_rows(session)
+            count = len(rows)
+        else:
+            count = 0
+            async for _ in book_service.iter_book_rows(session):
+                count += 1
+
+        elapsed = time.perf_counter() - start
+        if trace:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{count} {elapsed:.3f} {current} {peak}")
+        else:
+            # ru_maxrss is in KiB on Linux
+            print(f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}")
+    await engine.dispose()
+
+
+def child(url: str, mode: str, trace: bool) -> list:
+    command = [sys.executable, "-m", "benchmarks.listing_memory", "--child", mode, "--url", url] + (["--trace"] if trace else [])
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return output.strip().splitlines()[-1].split()
+
+
+def run(books: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite+aiosqlite:///{os.path.join(tmp, 'books.db')}"
+        asyncio.run(seed(url, books))
+
+        print(f"{'mode':8} {'rows':>8} {'seconds':>8} {'B/row retained':>15} {'traced peak MiB':>16} {'peak RSS MiB':>13}")
+        for mode in MODES:
+            count, elapsed, current, peak = child(url, mode, trace=True)
+            (rss,) = child(url, mode, trace=False)
+            per_row = int(current) / max(int(count), 1)
+            print(f"{mode:8} {count:>8} {float(elapsed):8.2f} {per_row:15.0f} {int(peak) / 2**20:16.1f} {int(rss) / 2**20:13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--child", choices=MODES)
+    parser.add_argument("--url")
+    parser.add_argument("--trace", action="store_true")
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(listing(args.url, args.child, args.trace))
+    else:
+        run(args.books)
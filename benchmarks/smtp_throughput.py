@@ -0,0 +1,89 @@
+"""
+Mail worker throughput against a local SMTP sink: one connection per message (the old
+fastapi_mail path) vs the pooled session used by send_email, vs send_email_batch.
+The sink speaks plain SMTP, so the gap seen here is a lower bound: a real provider adds a STARTTLS
+handshake and a login to every new connection.
+
+    python -m benchmarks.smtp_throughput --messages 500
+"""
+import argparse, asyncio, smtplib, threading, time
+from src.smtp_pool import SMTPConnectionPool, build_message
+
+
+class SinkProtocol(asyncio.Protocol):
+    """Just enough SMTP to accept and discard messages"""
+    def connection_made(self, transport):
+        self.transport = transport
+        self.buffer = b""
+        self.in_data = False
+        transport.write(b"220 sink ready\r\n")
+
+    def data_received(self, data):
+        self.buffer += data
+        while b"\r\n" in self.buffer:
+            if self.in_data:
+                end = self.buffer.find(b"\r\n.\r\n")
+                if end == -1 and not self.buffer.startswith(b".\r\n"):
+                    return
+                self.buffer = self.buffer[3:] if self.buffer.startswith(b".\r\n") else self.buffer[end + 5:]
+                self.in_data = False
+                self.transport.write(b"250 queued\r\n")
+                continue
+
+            line, self.buffer = self.buffer.split(b"\r\n", 1)
+            verb = line[:4].upper()
+            if verb == b"EHLO":
+                self.transport.write(b"250-sink\r\n250 8BITMIME\r\n")
+            elif verb == b"DATA":
+                self.in_data = True
+                self.transport.write(b"354 go ahead\r\n")
+            elif verb == b"QUIT":
+                self.transport.write(b"221 bye\r\n")
+                self.transport.close()
+            else:
+                self.transport.write(b"250 ok\r\n")
+
+
+def start_sink(port: int) -> asyncio.AbstractServer:
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(loop.create_server(SinkProtocol, "127.0.0.1", port))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server
+
+
+def connection_per_message(port: int, count: int) -> None:
+    for i in range(count):
+        with smtplib.SMTP("127.0.0.1", port) as conn:
+            conn.send_message(build_message([f"user{i}@example.com"], "Welcome", "<h1>Welcome to Booklynn</h1>"))
+
+
+def pooled(port: int, count: int) -> None:
+    pool = SMTPConnectionPool("127.0.0.1", port, starttls=False, use_credentials=False, max_messages=count)
+    for i in range(count):
+        pool.send(build_message([f"user{i}@example.com"], "Welcome", "<h1>Welcome to Booklynn</h1>"))
+    pool.close_all()
+
+
+def batched(port: int, count: int) -> None:
+    pool = SMTPConnectionPool("127.0.0.1", port, starttls=False, use_credentials=False, max_messages=count)
+    pool.send_many(build_message([f"user{i}@example.com"], "Welcome", "<h1>Welcome to Booklynn</h1>") for i in range(count))
+    pool.close_all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    start_sink(args.port)
+
+    for name, run in [("connection per message", connection_per_message), ("pooled send", pooled), ("batched send", batched)]:
+        start = time.perf_counter()
+        run(args.port, args.messages)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<24} {args.messages / elapsed:>10.0f} msg/s  ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,42 @@
 # app.include_router(book_router, prefix=f"/api/{version}/books", tags=["books"])
 
 from src.errors import register_all_errors
-import logging
+import logging, asyncio
 from contextlib import asynccontextmanager
-from src.db.main import initdb
+from src.db.main import initdb, warm_pool
 
 from fastapi import FastAPI
 from src.routesv2 import book_router
 from src.auth.routes import auth_router
 from src.reviews.routes import review_router
+from src.batch.routes import batch_router
+from src.admin.routes import admin_router, metrics_router
 from .middleware import register_middleware
+from .access_log import log_writer
+from .dispatcher import task_dispatcher
+from .outbox import outbox_relay
+from .cache import cache_invalidation_listener
+from .db.redis import redis_client
+from .loop_monitor import loop_monitor
 
 # the lifespan event
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # connections are opened before the worker accepts its first request
+    await asyncio.gather(warm_pool(), redis_client.open())
+    loop_monitor.start()
+    log_writer.start()
+    task_dispatcher.start()
+    outbox_relay.start()
+    cache_invalidation_listener.start()
     yield
+    await loop_monitor.stop()
+    await cache_invalidation_listener.stop()
+    await outbox_relay.stop()
+    # flush queued celery tasks and log lines before the worker exits
+    await asyncio.to_thread(task_dispatcher.stop)
+    await asyncio.to_thread(log_writer.stop)
+    await redis_client.close()
 
 version="v2"
 
@@ -58,4 +80,19 @@ app.include_router(
     review_router,
     prefix=f"/{version}/review",
     tags=['review']
-)
\ No newline at end of file
+)
+
+app.include_router(
+    batch_router,
+    prefix=f"/{version}/batch",
+    tags=['batch']
+)
+
+app.include_router(
+    admin_router,
+    prefix=f"/{version}/admin",
+    tags=['admin']
+)
+
+# scraped by Prometheus, so it sits outside the versioned API
+app.include_router(metrics_router)
\ No newline at end of file
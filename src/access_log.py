@@ -0,0 +1,92 @@
+import json, logging, queue, sys, threading
+from logging.handlers import QueueHandler
+from typing import IO, Optional
+from src.config import Config
+
+# sentinel telling the writer thread to finish
+_STOP = None
+
+
+class AccessLogHandler(QueueHandler):
+    """
+    Hands access records to the writer thread as they are: no formatting and no I/O on the event loop,
+    and a full queue drops the record instead of blocking the request.
+    """
+    def __init__(self, log_queue: "queue.Queue") -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLogWriter:
+    """Writes queued access records as JSON lines, whatever has piled up goes out in a single write"""
+    def __init__(self, log_queue: "queue.Queue", stream: IO[str], batch_size: int) -> None:
+        self.queue = log_queue
+        self.stream = stream
+        self.batch_size = batch_size
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="access-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            record = self.queue.get()
+            stopping = record is _STOP
+            lines = [] if stopping else [self.format(record)]
+
+            while len(lines) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    continue
+                lines.append(self.format(record))
+
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except Exception as e:
+                    print(f"access log write failed: {e}", file=sys.stderr)
+            if stopping:
+                return
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = record.msg if isinstance(record.msg, dict) else {"message": record.getMessage()}
+        return json.dumps({"ts": round(record.created, 3), **entry}, default=str)
+
+
+# one queue and writer thread per process, shared by the access log and the slow query log
+log_queue: "queue.Queue" = queue.Queue(maxsize=Config.ACCESS_LOG_QUEUE_SIZE)
+log_writer = AccessLogWriter(log_queue, sys.stdout, batch_size=Config.ACCESS_LOG_BATCH_SIZE)
+
+
+def structured_logger(name: str) -> logging.Logger:
+    """A logger whose dict messages are written as JSON lines by the writer thread"""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not any(isinstance(handler, AccessLogHandler) for handler in logger.handlers):
+        logger.addHandler(AccessLogHandler(log_queue))
+    return logger
@@ -0,0 +1,47 @@
+import asyncio, logging
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import Response
+from src.auth.dependencies import RoleChecker
+from src.config import Config
+from src.db.instrumentation import slow_queries
+from src.db.redis import get_queue_stats
+from src.metrics import registry, CELERY_QUEUE_DEPTH, CELERY_QUEUE_LATENCY, QUEUE_LATENCY_BUCKETS
+
+
+admin_router = APIRouter()
+metrics_router = APIRouter()
+admin_role_checker = Depends(RoleChecker(["admin"]))
+
+
+@admin_router.get("/queues", dependencies=[admin_role_checker])
+async def get_celery_queues():
+    # depth of each celery queue and the enqueue -> sent latency recorded by the workers
+    return await get_queue_stats([Config.CELERY_TRANSACTIONAL_QUEUE, Config.CELERY_BULK_QUEUE])
+
+
+@admin_router.get("/slow-queries", dependencies=[admin_role_checker])
+async def get_slow_queries(limit: int = Query(20, ge=1, le=Config.SLOW_QUERY_MAX_FINGERPRINTS)):
+    # per worker process, ranked by the total time spent in each query shape
+    return {"threshold_ms": Config.SLOW_QUERY_MS, "queries": slow_queries.top(limit)}
+
+
+@admin_router.delete("/slow-queries", dependencies=[admin_role_checker], status_code=204)
+async def reset_slow_queries():
+    slow_queries.reset()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    # the celery queue numbers live in Redis, the rest is this worker's own
+    try:
+        stats = await asyncio.wait_for(get_queue_stats([Config.CELERY_TRANSACTIONAL_QUEUE, Config.CELERY_BULK_QUEUE]), timeout=1.0)
+    except Exception as e:
+        logging.warning("Celery queue stats unavailable: %s", e)
+        stats = {}
+
+    for queue, queue_stats in stats.items():
+        CELERY_QUEUE_DEPTH.set(queue_stats["depth"], queue)
+        cumulative = [queue_stats["latency_buckets"][str(bucket)] for bucket in QUEUE_LATENCY_BUCKETS] + [queue_stats["sent"]]
+        CELERY_QUEUE_LATENCY.set_raw((queue,), cumulative, queue_stats["latency_sum"])
+
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -4,7 +4,7 @@ from fastapi import status
 from src.errors import *
 from src.auth.utils import decode_token
 from fastapi import Request
-from src.db.redis import token_in_blocklist
+from src.db.redis import token_revoked
 from fastapi import Depends
 from src.db.main import get_session
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -45,13 +45,21 @@ class TokenBearer(HTTPBearer):
 
         token = creds.credentials if creds else None
 
-        if not self.token_valid(token):
-            raise InvalidToken()
+        # a token already verified for this request (or its parent batch request) is not checked again
+        verified = getattr(request.state, "verified_token", None)
 
-        token_data = decode_token(token) if token else None
+        if verified and verified[0] == token:
+            token_data = verified[1]
+        else:
+            token_data = decode_token(token) if token else None
+
+            if token_data is None:
+                raise InvalidToken()
 
-        if token_data and await token_in_blocklist(token_data['jti']):
-            raise InvalidToken()
+            if await token_revoked(token_data):
+                raise InvalidToken()
+
+            request.state.verified_token = (token, token_data)
 
         self.verify_token_data(token_data)
 
@@ -82,11 +90,17 @@ class RefreshTokenBearer(TokenBearer):
 
 
 async def get_current_user(
+    request: Request,
     token_details: dict = Depends(AccessTokenBearer()),
     session: AsyncSession = Depends(get_session),
 ):
     user_email = token_details["user"]["email"]   # token_details.get("user").get("email")
 
+    # set by the batch endpoint, so sub-requests don't look the user up again
+    current_user = getattr(request.state, "current_user", None)
+    if current_user is not None and current_user.email == user_email:
+        return current_user
+
     user = await user_service.get_user_by_email(user_email, session)
 
     return user
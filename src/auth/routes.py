@@ -1,77 +1,106 @@
 from fastapi import APIRouter, Depends, status, Body, BackgroundTasks
-from src.celery_task import send_email
+from src.dispatcher import task_dispatcher
+from src.outbox import outbox_message, outbox_relay
 from src.errors import InvalidCredentials, InvalidToken, UserAlreadyExists, UserNotFound
-from .schema import PasswordResetConfirmModel, PasswordResetRequestModel, UserCreateModel, UserModel, UserLoginModel, UserBooksModel
+from .schema import LogoutModel, PasswordResetConfirmModel, PasswordResetRequestModel, UserCreateModel, UserModel, UserLoginModel, UserBooksModel
 from .service import UserService
 from src.db.main import get_session
 from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi.exceptions import HTTPException
-from .utils import generate_password_hash, verify_password, create_access_token
+from .utils import generate_password_hash, verify_password, create_access_token, decode_token
 from datetime import timedelta, datetime
 from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
 from fastapi import Form, Query
 from .dependencies import (AccessTokenBearer, RefreshTokenBearer, get_current_user, RoleChecker)
-from src.db.redis import add_jti_to_blocklist, token_in_blocklist
+from src.db.redis import revoke_tokens, revoke_all_sessions, create_mail_job, get_mail_job
 from src.db.models import User
 from sqlmodel import select
-from uuid import UUID
+from uuid import UUID, uuid4
 from src.auth.schema import EmailModel
-from src.mail import mail, create_message
 from src.auth.utils import create_url_safe_token, decode_url_safe_token
 from src.config import Config
+from src.rate_limit import RateLimiter
 
 
 auth_router = APIRouter()
 user_service = UserService()
 admin_role_checker = RoleChecker(allowed_roles=["admin"])
 user_role_checker = RoleChecker(allowed_roles=["admin", "user"])
+# per client IP, these run before the user has a token
+login_rate_limit = Depends(RateLimiter("login", Config.RATE_LIMIT_LOGIN))
+signup_rate_limit = Depends(RateLimiter("signup", Config.RATE_LIMIT_SIGNUP))
+password_reset_rate_limit = Depends(RateLimiter("password-reset", Config.RATE_LIMIT_PASSWORD_RESET))
 
 @auth_router.get("/me", response_model=UserBooksModel)
 async def get_curr_user(user: User = Depends(get_current_user), _: bool = Depends(user_role_checker)):
     return user
 
-@auth_router.post("/send-mail")
+@auth_router.post("/send-mail", status_code=status.HTTP_202_ACCEPTED)
 async def send_mail(emails: EmailModel):
-    addresses = emails.addresses
+    # drop blanks and duplicates (case-insensitive), keeping the first spelling of each address
+    unique = {}
+    for address in emails.addresses:
+        address = address.strip()
+        if address:
+            unique.setdefault(address.lower(), address)
+    addresses = list(unique.values())
 
-    html = "<h1>Welcome to Booklynn</h1>"
     subject = "Hello user, thankyou for using Booklynn"
 
     # message=create_message(recipients=addresses, subject=subject, body=html)
     # await mail.send_message(message)
-    send_email.delay(addresses, subject, html)
 
-    return {"message": "Email Sent Successfully"}
+    # fan the recipients out in chunks across the workers, instead of one task holding the whole list
+    size = Config.MAIL_BULK_CHUNK_SIZE
+    chunks = [addresses[i:i + size] for i in range(0, len(addresses), size)]
+    job_id = str(uuid4())
+
+    await create_mail_job(job_id, recipients=len(addresses), chunks=len(chunks))
+    if chunks:
+        # celery is imported on first use, it is not needed to start the API
+        from celery import group
+        from src.celery_task import send_bulk_chunk
+        task_dispatcher.enqueue_signature(group(send_bulk_chunk.s(job_id, chunk, subject, "welcome.html") for chunk in chunks))
+
+    return {"message": "Email Sent Successfully", "job_id": job_id, "recipients": len(addresses), "chunks": len(chunks)}
+
+
+@auth_router.get("/send-mail/{job_id}")
+async def get_mail_job_status(job_id: str):
+    job = await get_mail_job(job_id)
+
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Mail job not found")
+
+    finished = job["chunks_done"] + job["chunks_failed"] >= job["chunks"]
+
+    return {"job_id": job_id, "status": "completed" if finished else "in_progress", **job}
 
 
 #! New signup w email verification
 
-@auth_router.post("/signup", status_code=status.HTTP_201_CREATED)
+@auth_router.post("/signup", status_code=status.HTTP_201_CREATED, dependencies=[signup_rate_limit])
 async def create_user_account(user_data: UserCreateModel, bg_task: BackgroundTasks, session: AsyncSession = Depends(get_session),):
     email = user_data.email
     user_exists = await user_service.get_user_by_email(email, session)
     if user_exists:
         raise UserAlreadyExists()
 
-    new_user  = await user_service.create_user(user_data, session)
-
     token = create_url_safe_token({"email": email})
 
     link = f"http://{Config.DOMAIN}/v2/auth/verify/{token}"
 
-    html_message = f"""
-    <h3>Welcome to Booklynn! Verify your Email for Signup</h3>
-    <p>Please click this <a href="{link}">link</a> to verify your email.</p>
-    <br></br>
-    <p>Thanks.</p>
-    """
     subject="Verify your Email for Booklynn"
 
     # message = create_message(recipients=[email], subject="Verify your Email for Booklynn", body=html_message)
     # await mail.send_message(message)
     # bg_task.add_task(mail.send_message, message)
 
-    send_email.delay([email], subject, html_message)
+    # the verification email goes into the outbox in the same commit as the user, the relay publishes it
+    from src.celery_task import send_email
+    verification_email = outbox_message(send_email.name, [email], subject, "verify_email.html", {"link": link})
+    new_user = await user_service.create_user(user_data, session, outbox=[verification_email])
+    outbox_relay.notify()
 
     return {
         "message": "Account Created Successfully! Check email to verify the account.",
@@ -115,7 +144,13 @@ async def verify_token_submit(token: str = Form(...)):
 
 
 
-@auth_router.post("/login")
+def access_token_claims(user: User) -> dict:
+    # role and is_verified let the response cache authorize a request without loading the user,
+    # access tokens are short-lived and only issued from the user row (login, refresh)
+    return {"email": user.email, "user_uid": str(user.uid), "role": user.role, "is_verified": user.is_verified}
+
+
+@auth_router.post("/login", dependencies=[login_rate_limit])
 async def login_user(login_data: UserLoginModel, session: AsyncSession = Depends(get_session)):
     email = login_data.email
     password = login_data.password
@@ -126,9 +161,9 @@ async def login_user(login_data: UserLoginModel, session: AsyncSession = Depends
         password_valid = verify_password(password, user.password_hash)
 
         if password_valid:
-            access_token = create_access_token(
-                user_data={"email": user.email, "user_uid": str(user.uid)})
+            access_token = create_access_token(user_data=access_token_claims(user))
 
+            # no role or verification here: they are read again from the user on each refresh
             refresh_token = create_access_token(
                 user_data={"email": user.email, "user_uid": str(user.uid)},
                 refresh=True,
@@ -147,12 +182,17 @@ async def login_user(login_data: UserLoginModel, session: AsyncSession = Depends
 
 
 @auth_router.post("/refresh")
-async def get_refresh_token(token_details: dict = Depends(RefreshTokenBearer())):
+async def get_refresh_token(token_details: dict = Depends(RefreshTokenBearer()), session: AsyncSession = Depends(get_session)):
 
     expiry_time = token_details.get("exp")
 
     if expiry_time and datetime.fromtimestamp(expiry_time) > datetime.now():
-        new_access_token = create_access_token(user_data=token_details.get("user") or {})
+        # the user as it is now: a deleted user gets no new token, a changed role or verification is picked up
+        user = await user_service.get_user_by_email((token_details.get("user") or {}).get("email"), session)
+        if user is None:
+            raise InvalidToken()
+
+        new_access_token = create_access_token(user_data=access_token_claims(user))
 
         return JSONResponse(content={"access_token": new_access_token})
 
@@ -161,18 +201,36 @@ async def get_refresh_token(token_details: dict = Depends(RefreshTokenBearer()))
 
 
 @auth_router.get("/logout")
-async def logout_user_revoke_token(token_details: dict = Depends(AccessTokenBearer())):
+@auth_router.post("/logout")
+async def logout_user_revoke_token(token_details: dict = Depends(AccessTokenBearer()), body: LogoutModel | None = Body(None)):
     
     jti = token_details.get("jti")
 
     if not jti:
         raise InvalidToken()
 
-    await add_jti_to_blocklist(jti)
+    tokens = [token_details]
+    if body is not None and body.refresh_token:
+        refresh_details = decode_token(body.refresh_token)
+        if refresh_details is None or not refresh_details.get("refresh") or \
+                refresh_details.get("user", {}).get("user_uid") != token_details["user"]["user_uid"]:
+            raise InvalidToken()
+        tokens.append(refresh_details)
+
+    # each JTI is kept until its token expires, in one round trip
+    await revoke_tokens(tokens)
 
     return JSONResponse(content={"message": "Logged out successfully, Token revoked successfully"}, status_code=status.HTTP_200_OK)
 
 
+@auth_router.post("/logout-all")
+async def logout_all_sessions(token_details: dict = Depends(AccessTokenBearer())):
+    # every access and refresh token of the user issued until now, this one included
+    await revoke_all_sessions(token_details["user"]["user_uid"])
+
+    return JSONResponse(content={"message": "Logged out of all sessions"}, status_code=status.HTTP_200_OK)
+
+
 @auth_router.delete("/users/{user_uid}")
 async def delete_user(user_uid: str, session: AsyncSession = Depends(get_session)):
     # Support both hyphenated UUIDs and 32-char hex without hyphens
@@ -218,12 +276,15 @@ async def delete_user(user_uid: str, session: AsyncSession = Depends(get_session
         await session.rollback()
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Cannot delete user due to related records")
 
+    # its access tokens would otherwise keep being served from the response cache until they expire
+    await revoke_all_sessions(uid_str)
+
     return JSONResponse(content={"message": "User deleted successfully", "uid": uid_str}, status_code=status.HTTP_200_OK)
 
 
 #! Password reset routes
 
-@auth_router.post("/password-reset")
+@auth_router.post("/password-reset", dependencies=[password_reset_rate_limit])
 async def password_reset(email_data: PasswordResetRequestModel):
     email = email_data.email
 
@@ -232,10 +293,6 @@ async def password_reset(email_data: PasswordResetRequestModel):
     # Point the user directly to the frontend with token so they can set a new password
     link = f"{Config.FRONTEND_URL}?token={token}"
 
-    html_message = f"""
-    <h3>Reset Your Password </h3>
-    <p>Please click this <a href="{link}">link</a> to Reset Your Password</p>
-    """
     subject = "Reset Your Booklynn Account Password"
     # maybe, implement some background task so tht the current impl doesnt block the req until SMTP call finishes
     # using BAckgroud tasks will make the api respond immediately while the email is sent in the bg
@@ -244,7 +301,8 @@ async def password_reset(email_data: PasswordResetRequestModel):
     # message = create_message(recipients=[email], subject=subject, body=html_message)
     # await mail.send_message(message)
 
-    send_email.delay([email], subject, html_message) #sends email in the background
+    from src.celery_task import send_email
+    task_dispatcher.enqueue(send_email, [email], subject, "password_reset.html", {"link": link}) #sends email in the background, without waiting on the broker
 
     return JSONResponse(content= {
         "message": "Please check your email to reset your password.",
@@ -271,6 +329,8 @@ async def password_reset_confirm(token: str, passwords: PasswordResetConfirmMode
 
         pwd_hash = generate_password_hash(new_password)
         await user_service.update_user(user, {"password_hash": pwd_hash}, session)
+        # sessions opened with the old password end with it
+        await revoke_all_sessions(str(user.uid))
 
         return JSONResponse(
             content = {"message": "Password Reset Successfully"},
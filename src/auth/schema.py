@@ -1,7 +1,7 @@
 from pydantic import BaseModel, Field
 import uuid
 from datetime import datetime
-from typing import List, Literal
+from typing import List, Literal, Optional
 from src.schema import Book
 # from src.review.schema import ReviewModel
 
@@ -60,3 +60,8 @@ class PasswordResetRequestModel(BaseModel):
 class PasswordResetConfirmModel(BaseModel):
     new_password: str
     confirm_new_password: str
+
+
+class LogoutModel(BaseModel):
+    # revoked together with the access token when given
+    refresh_token: Optional[str] = None
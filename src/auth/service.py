@@ -1,4 +1,5 @@
-from src.db.models import User
+from src.db.models import User, OutboxMessage
+from typing import List, Optional
 from .schema import UserCreateModel
 from .utils import generate_password_hash
 from sqlmodel.ext.asyncio.session import AsyncSession
@@ -20,7 +21,7 @@ class UserService:
 
         return True if user is not None else False
 
-    async def create_user(self, user_data: UserCreateModel, session: AsyncSession):
+    async def create_user(self, user_data: UserCreateModel, session: AsyncSession, outbox: Optional[List[OutboxMessage]] = None):
         user_data_dict = user_data.model_dump()
         
         # Remove password from dict as it's not a field in User model
@@ -33,6 +34,11 @@ class UserService:
         new_user.password_hash = generate_password_hash(password)
 
         session.add(new_user)
+
+        # committed together with the user, so the user never exists without its emails
+        for message in outbox or []:
+            session.add(message)
+
         await session.commit()
 
         return new_user
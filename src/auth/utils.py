@@ -1,11 +1,12 @@
 import bcrypt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 import jwt 
 from src.config import Config
-import logging, uuid
+from src.metrics import BCRYPT_LATENCY, CACHE_REQUESTS, TOKENS_REJECTED
+import hashlib, logging, math, re, time, uuid
+from collections import OrderedDict
 from typing import Optional
-from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from functools import lru_cache
 from fastapi import HTTPException
 
 
@@ -17,7 +18,8 @@ def generate_password_hash(password: str) -> str:
     
     # Generate salt and hash
     salt = bcrypt.gensalt()
-    hash_bytes = bcrypt.hashpw(password_bytes, salt)
+    with BCRYPT_LATENCY.time("hash"):
+        hash_bytes = bcrypt.hashpw(password_bytes, salt)
     return hash_bytes.decode('utf-8')
 
 
@@ -27,7 +29,8 @@ def verify_password(password: str, hash: str) -> bool:
         password_bytes = password_bytes[:72]
     
     hash_bytes = hash.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hash_bytes)
+    with BCRYPT_LATENCY.time("verify"):
+        return bcrypt.checkpw(password_bytes, hash_bytes)
 
 
 def create_access_token(user_data: dict, expiry:timedelta=timedelta(minutes=15), refresh:bool =False) -> str:
@@ -35,7 +38,9 @@ def create_access_token(user_data: dict, expiry:timedelta=timedelta(minutes=15),
         'user':user_data,
         'exp': datetime.now() + (expiry if expiry is not None else timedelta(minutes=60)),
         'refresh':refresh,
-        'jti':str(uuid.uuid4())
+        'jti':str(uuid.uuid4()),
+        # compared with the user's session epoch when all their sessions are revoked
+        'iat':time.time(),
     }
 
     token = jwt.encode(payload=payload, key=Config.JWT_SECRET_KEY, algorithm=Config.JWT_ALGORITHM)
@@ -43,34 +48,119 @@ def create_access_token(user_data: dict, expiry:timedelta=timedelta(minutes=15),
     return token
 
 
+# header.payload.signature, base64url without padding; anything else is not worth parsing
+TOKEN_SHAPE = re.compile(r"[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+")
+
+
+class VerifiedTokens:
+    """
+    Claims of tokens whose signature was already checked, by digest of the token, until they expire.
+    Requests of the same session then skip the HMAC and the JSON parsing. The claims are shared, callers
+    must not modify them.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, dict]" = OrderedDict()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self.digest(token)
+        claims = self._entries.get(key)
+        if claims is None:
+            return None
+        if claims.get("exp", math.inf) <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def set(self, token: str, claims: dict) -> None:
+        key = self.digest(token)
+        self._entries[key] = claims
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+verified_tokens = VerifiedTokens(Config.JWT_CACHE_SIZE)
+
+
+class RejectionLog:
+    """One warning, without traceback, per interval for rejected tokens, however many arrive"""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.suppressed = 0
+        self.logged_at = -math.inf
+
+    def rejected(self, reason: str, error: Exception | None = None) -> None:
+        TOKENS_REJECTED.inc(reason)
+        now = time.monotonic()
+        if now - self.logged_at < self.interval:
+            self.suppressed += 1
+            return
+        logging.warning("Rejected token (%s): %s; %d more rejected since the last message", reason, error or reason, self.suppressed)
+        self.suppressed = 0
+        self.logged_at = now
+
+
+rejection_log = RejectionLog(Config.JWT_REJECT_LOG_INTERVAL)
+
+
 def decode_token(token: str) -> dict | None:
+    if len(token) > Config.JWT_MAX_LENGTH:
+        rejection_log.rejected("malformed")
+        return None
+
+    claims = verified_tokens.get(token)
+    if claims is not None:
+        CACHE_REQUESTS.inc("jwt", "local", "hit")
+        return claims
+    CACHE_REQUESTS.inc("jwt", "local", "miss")
+
+    if not TOKEN_SHAPE.fullmatch(token):
+        rejection_log.rejected("malformed")
+        return None
+
     try:
         token_data = jwt.decode(jwt=token, key=Config.JWT_SECRET_KEY, algorithms=[Config.JWT_ALGORITHM])
-        return token_data
-    
-    except jwt.PyJWTError as jwte:
-        logging.exception(jwte)
+    except jwt.ExpiredSignatureError as e:
+        rejection_log.rejected("expired", e)
+        return None
+    except jwt.InvalidSignatureError as e:
+        rejection_log.rejected("signature", e)
         return None
-    
     except Exception as e:
-        logging.exception(e)
+        rejection_log.rejected("invalid", e)
         return None
 
+    verified_tokens.set(token, token_data)
+    return token_data
+
 
 # For serializing the user’s email address
 
-serializer = URLSafeTimedSerializer(secret_key=Config.JWT_SECRET_KEY, salt="email-configuration")
+@lru_cache(maxsize=None)
+def get_serializer():
+    # itsdangerous is only needed by the verification and password reset links
+    from itsdangerous import URLSafeTimedSerializer
+    return URLSafeTimedSerializer(secret_key=Config.JWT_SECRET_KEY, salt="email-configuration")
 
 
 def create_url_safe_token(data: dict, expiration=3600) -> str:
     # Create a URL-safe token. Expiration is enforced during loads via max_age.
-    return serializer.dumps(data)
+    return get_serializer().dumps(data)
 
 def decode_url_safe_token(token: str, max_age=3600) -> dict:
     # Decode a URL-safe token and check for expiration. 
+    from itsdangerous import BadSignature, SignatureExpired
     try:
         # Deserialize the token and check if it's expired
-        data = serializer.loads(token, max_age=max_age)
+        data = get_serializer().loads(token, max_age=max_age)
         return data
     except SignatureExpired:
         raise HTTPException(status_code=400, detail="Token has expired")
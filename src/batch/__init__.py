@@ -0,0 +1,3 @@
+from .routes import batch_router
+
+__all__ = ["batch_router"]
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends, Request
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.db.main import get_session
+from src.db.models import User
+from src.auth.dependencies import AccessTokenBearer, RoleChecker, get_current_user
+from .schema import BatchRequestModel, BatchResponseModel
+from .service import BatchService
+
+
+batch_router = APIRouter()
+batch_service = BatchService()
+access_token_bearer = AccessTokenBearer()
+user_role_checker = Depends(RoleChecker(["admin", "user"]))
+
+
+@batch_router.post("/", response_model=BatchResponseModel, dependencies=[user_role_checker])
+async def run_batch(batch: BatchRequestModel, request: Request, session: AsyncSession = Depends(get_session),
+                    token_details: dict = Depends(access_token_bearer), curr_user: User = Depends(get_current_user)):
+    # the token and user are resolved once here, every sub-request reuses them instead of re-authenticating
+    state = {
+        "verified_token": request.state.verified_token,
+        "current_user": curr_user,
+    }
+
+    responses = await batch_service.run(request, batch.requests, state, session)
+
+    return {"responses": responses}
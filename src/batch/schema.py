@@ -0,0 +1,49 @@
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, Dict, List, Literal, Optional
+from src.config import Config
+
+
+class SubRequestModel(BaseModel):
+    id: Optional[str] = None
+    method: Literal["GET", "POST", "PATCH", "PUT", "DELETE"] = "GET"
+    path: str = Field(..., description="Path relative to the API version root, e.g. /books/")
+    headers: Dict[str, str] = {}
+    body: Optional[Any] = None
+
+    @field_validator("path")
+    @classmethod
+    def validate_path(cls, val: str) -> str:
+        if not val.startswith("/"):
+            raise ValueError("path must start with '/'")
+        if val.startswith("/batch"):
+            raise ValueError("batch requests cannot be nested")
+        return val
+
+
+class BatchRequestModel(BaseModel):
+    requests: List[SubRequestModel] = Field(..., min_length=1, max_length=Config.BATCH_MAX_REQUESTS)
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "requests": [
+                        {"id": "books", "method": "GET", "path": "/books/"},
+                        {"id": "reviews", "method": "GET", "path": "/review/"},
+                        {"id": "me", "method": "GET", "path": "/auth/me"}
+                    ]
+                }
+            ]
+        }
+    }
+
+
+class SubResponseModel(BaseModel):
+    id: Optional[str] = None
+    status: int
+    headers: Dict[str, str]
+    body: Any
+
+
+class BatchResponseModel(BaseModel):
+    responses: List[SubResponseModel]
@@ -0,0 +1,141 @@
+import asyncio, json, logging, re
+from typing import Any, Dict, List
+from fastapi import Request
+from sqlmodel.ext.asyncio.session import AsyncSession
+from src.config import Config
+from .schema import SubRequestModel, SubResponseModel
+
+# headers of the outer request that every sub-request inherits (TrustedHostMiddleware needs the host)
+FORWARDED_HEADERS = {"host", "authorization", "user-agent", "accept", "accept-language"}
+
+# only these known side-effect free reads run concurrently, everything else (GET /auth/logout and
+# /auth/verify/{token} included) runs in order
+CONCURRENT_READS = re.compile(
+    r"/books/|/books/[^/]+|/review/|/review/book/[^/]+|/auth/me|/auth/send-mail/[^/]+|/admin/queues|/admin/slow-queries"
+)
+
+# resolved once by the batch route, dropped after a write so the token and user are checked again
+# (a logout or a role change inside the batch applies to the sub-requests after it)
+AUTH_STATE = ("verified_token", "current_user")
+
+
+def is_concurrent_read(sub: SubRequestModel) -> bool:
+    return sub.method == "GET" and CONCURRENT_READS.fullmatch(sub.path.partition("?")[0]) is not None
+
+
+class BatchService:
+    """
+    Runs the sub-requests of a batch through the ASGI app in-process.
+    Consecutive reads run concurrently, each with its own pooled session (an AsyncSession is not safe
+    for concurrent use), writes run one at a time in the order given and share the batch's session.
+    After a write, the sub-requests authenticate again instead of reusing the batch's verified token.
+    """
+    async def run(self, request: Request, sub_requests: List[SubRequestModel], state: Dict[str, Any], session: AsyncSession) -> List[SubResponseModel]:
+        base_path = request.scope["path"].rsplit("/batch", 1)[0]
+        semaphore = asyncio.Semaphore(Config.BATCH_MAX_CONCURRENCY)
+        responses: List[Any] = [None] * len(sub_requests)
+        pending_reads: List[int] = []
+
+        async def run_read(idx: int):
+            async with semaphore:
+                responses[idx] = await self.dispatch(request, base_path, sub_requests[idx], state)
+
+        async def flush_reads():
+            if pending_reads:
+                await asyncio.gather(*(run_read(idx) for idx in pending_reads))
+                pending_reads.clear()
+
+        for idx, sub in enumerate(sub_requests):
+            if is_concurrent_read(sub):
+                pending_reads.append(idx)
+                continue
+
+            # a write must see the effects of everything before it
+            await flush_reads()
+            responses[idx] = await self.dispatch(request, base_path, sub, {**state, "shared_session": session})
+
+            if responses[idx].status >= 500 and session.in_transaction():
+                await session.rollback()
+            state = {key: val for key, val in state.items() if key not in AUTH_STATE}
+
+        await flush_reads()
+        return responses
+
+    async def dispatch(self, request: Request, base_path: str, sub: SubRequestModel, state: Dict[str, Any]) -> SubResponseModel:
+        path, _, query = sub.path.partition("?")
+        path = base_path + path
+
+        headers = {key: val for key, val in request.headers.items() if key in FORWARDED_HEADERS}
+        headers.update({key.lower(): val for key, val in sub.headers.items()})
+
+        body = b"" if sub.body is None else json.dumps(sub.body).encode("utf-8")
+        if body:
+            headers["content-type"] = "application/json"
+            headers["content-length"] = str(len(body))
+
+        scope = {
+            "type": "http",
+            "asgi": request.scope.get("asgi", {"version": "3.0"}),
+            "http_version": request.scope.get("http_version", "1.1"),
+            "method": sub.method,
+            "scheme": request.url.scheme,
+            "server": request.scope.get("server"),
+            "client": request.scope.get("client"),
+            "root_path": request.scope.get("root_path", ""),
+            "path": path,
+            "raw_path": path.encode("utf-8"),
+            "query_string": query.encode("latin-1"),
+            "headers": [(key.encode("latin-1"), val.encode("latin-1")) for key, val in headers.items()],
+            # marks a sub-request, it runs in the batch's concurrency slot
+            "state": {**state, "batch": True},
+        }
+
+        response_complete = asyncio.Event()
+        request_sent = False
+        status_code = 500
+        response_headers: Dict[str, str] = {}
+        chunks: List[bytes] = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers.update({key.decode("latin-1"): val.decode("latin-1") for key, val in message.get("headers", [])})
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response_complete.set()
+
+        try:
+            await request.app(scope, receive, send)
+        except Exception as e:
+            # the app has already sent its 500 response, we only keep the batch going
+            logging.exception(e)
+        finally:
+            response_complete.set()
+
+        response_headers.pop("content-length", None)
+        return SubResponseModel(
+            id=sub.id,
+            status=status_code,
+            headers=response_headers,
+            body=self.decode_body(b"".join(chunks), response_headers.get("content-type", "")),
+        )
+
+    def decode_body(self, raw: bytes, content_type: str) -> Any:
+        if not raw:
+            return None
+        if content_type.startswith("application/json"):
+            try:
+                return json.loads(raw)
+            except ValueError:
+                pass
+        return raw.decode("utf-8", errors="replace")
@@ -0,0 +1,358 @@
+import asyncio, functools, logging, time, uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import orjson
+from redis.exceptions import WatchError
+from src.config import Config
+from src.db.redis import redis_client
+from src.metrics import CACHE_REQUESTS, REDIS_LATENCY
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+# tells this worker's own invalidation messages apart from the other workers'
+WORKER_ID = uuid.uuid4().hex
+
+MISSING = object()
+
+caches: Dict[str, "Cache"] = {}
+
+# bumped by every local drop, a load that saw it change meanwhile may hold data older than the drop
+local_generation = 0
+# invalidations that did not reach Redis, retried in the background; until then this worker skips the Redis tier
+failed_keys: Set[str] = set()
+failed_tags: Set[str] = set()
+
+
+def tag_key(tag: str) -> str:
+    return f"cache:tag:{tag}"
+
+
+def generation_key(tag: str) -> str:
+    return f"cache:gen:{tag}"
+
+
+class Generations(NamedTuple):
+    """Taken before loading a value, `Cache.set` only stores it if no invalidation of its tags ran since"""
+    local: int
+    # the tags' generation counters in Redis, None when they could not be read
+    redis: Optional[List[Optional[bytes]]]
+
+
+class LocalTier:
+    """Bounded LRU with per-entry expiry, the values are shared by every request of the worker"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires, value, _ = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float, tags: Tuple[str, ...]) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value, tags)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def delete_tags(self, tags: Iterable[str]) -> None:
+        tags = set(tags)
+        for key in [key for key, (_, _, entry_tags) in self._entries.items() if tags.intersection(entry_tags)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class Cache:
+    """
+    Two tiers: a small in-process LRU for a few seconds, in front of Redis shared by all workers.
+    Values are stored as JSON (orjson, so dataclass rows such as `BookRow` work) and rebuilt with `decode`;
+    None is cached too, for `negative_ttl`, so lookups of missing rows do not reach the database either.
+    Entries carry tags, and `invalidate_tags` drops every entry with one of them, in every cache and worker.
+
+        book_cache = Cache("book", decode=lambda data: BookRow(**data))
+
+        @book_cache.cached(key=lambda self, book_uid, session: book_uid, tags=lambda self, book_uid, session: [f"book:{book_uid}"])
+        async def get_book_row(self, book_uid, session): ...
+
+    Redis errors are logged and treated as misses, the database stays the source of truth. While the Redis
+    circuit is open (see `ManagedRedis`) the local tier keeps serving and misses go straight to the loader.
+
+    A value loaded before a write commits must not be stored after the write invalidated its tags: each tag
+    has a generation counter in Redis that `invalidate_tags` bumps, `get_or_load` reads the counters before
+    loading and the write-back only goes through (under WATCH) if they did not move.
+    """
+
+    def __init__(self, name: str, decode: Optional[Callable[[Any], Any]] = None, ttl: float = Config.CACHE_TTL,
+                 local_ttl: float = Config.CACHE_LOCAL_TTL, local_size: int = Config.CACHE_LOCAL_SIZE,
+                 negative_ttl: float = Config.CACHE_NEGATIVE_TTL) -> None:
+        self.name = name
+        self.decode = decode or (lambda data: data)
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.negative_ttl = negative_ttl
+        self.local = LocalTier(local_size)
+        caches[name] = self
+
+    def redis_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    async def get(self, key: str) -> Any:
+        """The cached value (None included), or MISSING"""
+        full_key = self.redis_key(key)
+        value = self.local.get(full_key)
+        if value is not MISSING:
+            CACHE_REQUESTS.inc(self.name, "local", "hit")
+            return value
+        CACHE_REQUESTS.inc(self.name, "local", "miss")
+        if failed_keys or failed_tags:
+            # Redis may still hold entries this worker failed to invalidate
+            return MISSING
+
+        try:
+            with REDIS_LATENCY.time("get"):
+                data = await redis_client.execute(lambda client: asyncio.wait_for(client.get(full_key), Config.CACHE_REDIS_TIMEOUT))
+        except Exception as e:
+            logging.warning("Cache %s read failed: %s", self.name, e)
+            data = None
+        if data is None:
+            CACHE_REQUESTS.inc(self.name, "redis", "miss")
+            return MISSING
+        CACHE_REQUESTS.inc(self.name, "redis", "hit")
+
+        decoded = orjson.loads(data)
+        value = None if decoded is None else self.decode(decoded)
+        # the tags live in Redis, a Redis hit is dropped locally by key or by its tags from the pub/sub message
+        self.local.set(full_key, value, self._local_ttl(value), ())
+        return value
+
+    async def generations(self, tags: Iterable[str]) -> Generations:
+        tags = list(tags)
+        if not tags:
+            return Generations(local_generation, [])
+        if failed_keys or failed_tags:
+            return Generations(local_generation, None)
+        try:
+            with REDIS_LATENCY.time("mget"):
+                counters = await redis_client.execute(lambda client: asyncio.wait_for(
+                    client.mget([generation_key(tag) for tag in tags]), Config.CACHE_REDIS_TIMEOUT
+                ))
+        except Exception as e:
+            logging.warning("Cache %s generation read failed: %s", self.name, e)
+            counters = None
+        return Generations(local_generation, counters)
+
+    async def set(self, key: str, value: Any, tags: Iterable[str] = (), since: Optional[Generations] = None) -> None:
+        """Store `value`; with `since`, only if none of `tags` was invalidated after those generations were read"""
+        full_key = self.redis_key(key)
+        tags = tuple(tags)
+        if since is None or since.local == local_generation:
+            self.local.set(full_key, value, self._local_ttl(value), tags)
+        if since is not None and since.redis is None:
+            return
+
+        ttl = self.ttl if value is not None else self.negative_ttl
+        counters = [generation_key(tag) for tag in tags]
+        async def write(client):
+            async with client.pipeline(transaction=since is not None) as pipe:
+                if since is not None and counters:
+                    await pipe.watch(*counters)
+                    if await pipe.mget(counters) != since.redis:
+                        return False
+                    pipe.multi()
+                pipe.set(full_key, orjson.dumps(value), px=int(ttl * 1000))
+                for tag in tags:
+                    pipe.sadd(tag_key(tag), full_key)
+                    pipe.expire(tag_key(tag), Config.CACHE_TAG_TTL)
+                try:
+                    await asyncio.wait_for(pipe.execute(), Config.CACHE_REDIS_TIMEOUT)
+                except WatchError:
+                    return False
+                return True
+
+        try:
+            with REDIS_LATENCY.time("pipeline"):
+                if not await redis_client.execute(write):
+                    logging.debug("Cache %s skipped a write-back of %s, invalidated while loading", self.name, key)
+        except Exception as e:
+            logging.warning("Cache %s write failed: %s", self.name, e)
+
+    async def delete(self, key: str) -> None:
+        full_key = self.redis_key(key)
+        self.local.delete(full_key)
+        await publish_invalidation(keys=[full_key])
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], tags: Iterable[str] = ()) -> Any:
+        value = await self.get(key)
+        if value is MISSING:
+            tags = list(tags)
+            since = await self.generations(tags)
+            value = await loader()
+            await self.set(key, value, tags, since)
+        return value
+
+    def cached(self, key: Callable[..., str], tags: Optional[Callable[..., Iterable[str]]] = None):
+        """Cache an async function (or service method) under key(*args, **kwargs), with tags(*args, **kwargs)"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                return await self.get_or_load(
+                    key(*args, **kwargs),
+                    lambda: fn(*args, **kwargs),
+                    tags(*args, **kwargs) if tags is not None else (),
+                )
+            return wrapper
+        return decorator
+
+    def _local_ttl(self, value: Any) -> float:
+        return self.local_ttl if value is not None else min(self.local_ttl, self.negative_ttl)
+
+
+def drop_local(keys: Iterable[str] = (), tags: Iterable[str] = ()) -> None:
+    global local_generation
+    keys, tags = list(keys), list(tags)
+    local_generation += 1
+    for cache in caches.values():
+        for key in keys:
+            cache.local.delete(key)
+        if tags:
+            cache.local.delete_tags(tags)
+
+
+def drop_all_local() -> None:
+    global local_generation
+    local_generation += 1
+    for cache in caches.values():
+        cache.local.clear()
+
+
+async def invalidate_tags(*tags: str, keys: Iterable[str] = ()) -> None:
+    """Drop every entry tagged with one of `tags`, and the Redis `keys`, call it after committing a write"""
+    keys = list(keys)
+    drop_local(keys=keys, tags=tags)
+    await publish_invalidation(keys=keys, tags=tags)
+
+
+async def publish_invalidation(keys: Iterable[str] = (), tags: Iterable[str] = ()) -> bool:
+    keys, tags = list(keys), list(tags)
+    tagged: Dict[str, List[str]] = {}
+
+    async def bump(client):
+        # the generations move first: a write-back that starts later is refused, one that finished earlier
+        # has already added its key to the tag set read here
+        async with client.pipeline(transaction=True) as pipe:
+            for tag in tags:
+                pipe.incr(generation_key(tag))
+                pipe.expire(generation_key(tag), Config.CACHE_TAG_TTL)
+                pipe.smembers(tag_key(tag))
+            return await asyncio.wait_for(pipe.execute(), Config.CACHE_REDIS_TIMEOUT)
+
+    async def publish(client):
+        async with client.pipeline(transaction=False) as pipe:
+            if keys:
+                pipe.delete(*keys)
+            # only the members read above, a fresh entry tagged since then stays reachable by the next write
+            for tag, members in tagged.items():
+                if members:
+                    pipe.srem(tag_key(tag), *members)
+            pipe.publish(INVALIDATION_CHANNEL, orjson.dumps({"origin": WORKER_ID, "keys": keys, "tags": tags}))
+            await asyncio.wait_for(pipe.execute(), Config.CACHE_REDIS_TIMEOUT)
+
+    try:
+        if tags:
+            with REDIS_LATENCY.time("pipeline"):
+                results = await redis_client.execute(bump)
+            for i, tag in enumerate(tags):
+                tagged[tag] = [key.decode() for key in results[3 * i + 2]]
+            keys += [key for members in tagged.values() for key in members]
+            # entries this worker copied from Redis are only known here by key
+            drop_local(keys=keys)
+
+        with REDIS_LATENCY.time("pipeline"):
+            await redis_client.execute(publish)
+    except Exception as e:
+        # retried by the listener; until then this worker skips the Redis tier, the other workers' local copies
+        # expire after CACHE_LOCAL_TTL
+        logging.warning("Cache invalidation of %s %s failed: %s", tags, keys, e)
+        failed_keys.update(keys)
+        failed_tags.update(tags)
+        return False
+    return True
+
+
+async def retry_failed_invalidations() -> None:
+    if not failed_keys and not failed_tags:
+        return
+    keys, tags = list(failed_keys), list(failed_tags)
+    failed_keys.clear()
+    failed_tags.clear()
+    if await publish_invalidation(keys=keys, tags=tags):
+        logging.warning("Cache invalidation of %s %s went through on retry", tags, keys)
+
+
+class CacheInvalidationListener:
+    """
+    Drops local entries invalidated by other workers, in the background of each API worker, and retries this
+    worker's invalidations that failed to reach Redis every CACHE_RESUBSCRIBE_INTERVAL seconds.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._run(), name="cache-invalidation"),
+            asyncio.create_task(self._retry(), name="cache-invalidation-retry"),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _retry(self) -> None:
+        while True:
+            await asyncio.sleep(Config.CACHE_RESUBSCRIBE_INTERVAL)
+            await retry_failed_invalidations()
+
+    async def _run(self) -> None:
+        while True:
+            # a long-lived connection of its own, outside the breaker and without socket timeout
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # messages sent while we were not subscribed are lost, start over
+                drop_all_local()
+                while True:
+                    # returns None after the timeout, each call pings Redis once the health check interval has passed
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=Config.REDIS_HEALTH_CHECK_INTERVAL)
+                    if message is None or message["type"] != "message":
+                        continue
+                    event = orjson.loads(message["data"])
+                    if event["origin"] != WORKER_ID:
+                        drop_local(event["keys"], event["tags"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Cache invalidation listener failed: %s", e)
+            finally:
+                await pubsub.reset()
+            await asyncio.sleep(Config.CACHE_RESUBSCRIBE_INTERVAL)
+
+
+cache_invalidation_listener = CacheInvalidationListener()
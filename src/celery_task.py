@@ -1,16 +1,176 @@
+import logging, time
 from celery import Celery
-from src.mail import mail, create_message
-from asgiref.sync import async_to_sync
+from celery.signals import before_task_publish, task_success, worker_process_init, worker_process_shutdown
+from redis import Redis, RedisError
+from src.config import Config
+from src.db.redis import mail_job_key, queue_latency_key, QUEUE_LATENCY_BUCKETS
+from src.dispatcher import task_dispatcher
+from src.mail import render_template, precompile_templates
+from src.smtp_pool import smtp_pool, build_message
 
 c_app = Celery()
 
 c_app.config_from_object("src.config")
 
+# sync client for the workers, job progress and the shared send rate live here
+redis_client = Redis.from_url(Config.REDIS_URL)
 
-@c_app.task()
-def send_email(recipients: list[str], subject: str, body: str):
 
-    message = create_message(recipients=recipients, subject=subject, body=body)
+def already_done(task_id: str) -> bool:
+    try:
+        return bool(redis_client.exists(f"task:done:{task_id}"))
+    except RedisError as e:
+        logging.warning("Idempotency check for task %s skipped: %s", task_id, e)
+        return False
 
-    async_to_sync(mail.send_message)(message)  #allows us to execute the async mail.send_message in a synchronous context, making it compatible with Celery tasks.
-    print("📧Email sent")
\ No newline at end of file
+def mark_done(task_id: str) -> None:
+    try:
+        redis_client.set(f"task:done:{task_id}", 1, ex=Config.OUTBOX_IDEMPOTENCY_TTL)
+    except RedisError as e:
+        logging.warning("Could not mark task %s as done: %s", task_id, e)
+
+
+# idempotent, so it is only acked once sent and redelivered if the worker dies mid-task; an SMTP error is retried,
+# acks_late alone would ack the failed task and lose the mail
+@c_app.task(bind=True, ignore_result=True, acks_late=True,
+            max_retries=Config.MAIL_MAX_RETRIES, default_retry_delay=Config.MAIL_RETRY_DELAY)
+def send_email(self, recipients: list[str], subject: str, template: str, context: dict | None = None):
+    # outbox messages are delivered at least once, the task id is their idempotency key
+    if already_done(self.request.id):
+        return
+
+    body = render_template(template, context)
+
+    # reuses an open, authenticated session from the worker's pool instead of a new connection + STARTTLS per mail
+    try:
+        smtp_pool.send(build_message(recipients=recipients, subject=subject, body=body))
+    except Exception as e:
+        raise self.retry(exc=e)
+    mark_done(self.request.id)
+    print("📧Email sent")
+
+
+def not_done(message_ids: list[str]) -> set[str]:
+    try:
+        done = redis_client.mget([f"task:done:{message_id}" for message_id in message_ids])
+    except RedisError as e:
+        logging.warning("Idempotency check for %d messages skipped: %s", len(message_ids), e)
+        return set(message_ids)
+    return {message_id for message_id, flag in zip(message_ids, done) if flag is None}
+
+
+# like send_email: acked once sent, redelivered or retried otherwise, and each message is only sent once
+@c_app.task(bind=True, ignore_result=True, acks_late=True,
+            max_retries=Config.MAIL_MAX_RETRIES, default_retry_delay=Config.MAIL_RETRY_DELAY)
+def send_email_batch(self, messages: list[list]):
+    # each item holds an idempotency key and the send_email arguments: [message_id, recipients, subject, template, context]
+    pending_ids = not_done([message_id for message_id, *_ in messages])
+    pending = [item for item in messages if item[0] in pending_ids]
+    if not pending:
+        return
+
+    try:
+        sent = smtp_pool.send_many(
+            (build_message(recipients, subject, render_template(*rest)) for _, recipients, subject, *rest in pending),
+            on_sent=lambda index: mark_done(pending[index][0]),
+        )
+    except Exception as e:
+        # e.g. the SMTP server refused the connection, what went out before is marked done and skipped next time
+        raise self.retry(exc=e)
+    print(f"📧{sent}/{len(pending)} emails sent")
+
+
+def wait_for_send_slot() -> None:
+    """Blocks until the provider-wide per-second budget, shared by every worker, has room"""
+    while True:
+        window = int(time.time())
+        key = f"mail:rate:{window}"
+        with redis_client.pipeline() as pipe:
+            pipe.incr(key)
+            pipe.expire(key, 2)
+            count, _ = pipe.execute()
+        if count <= Config.MAIL_BULK_MAX_PER_SECOND:
+            return
+        time.sleep(max(window + 1 - time.time(), 0))
+
+
+@c_app.task(ignore_result=True)
+def send_bulk_chunk(job_id: str, recipients: list[str], subject: str, template: str, context: dict | None = None):
+    body = render_template(template, context)
+
+    # one message per recipient, so addresses aren't leaked to each other and a bad one doesn't sink the rest
+    def messages():
+        for recipient in recipients:
+            wait_for_send_slot()
+            yield build_message([recipient], subject, body)
+
+    key = mail_job_key(job_id)
+    # counted as they go, so a chunk that fails halfway still reports the mails it got out
+    sent = 0
+
+    def count_sent(index: int) -> None:
+        nonlocal sent
+        sent += 1
+
+    try:
+        smtp_pool.send_many(messages(), on_sent=count_sent)
+    except Exception:
+        # what was not accepted before the error is failed
+        with redis_client.pipeline() as pipe:
+            pipe.hincrby(key, "sent", sent)
+            pipe.hincrby(key, "failed", len(recipients) - sent)
+            pipe.hincrby(key, "chunks_failed", 1)
+            pipe.execute()
+        raise
+
+    with redis_client.pipeline() as pipe:
+        pipe.hincrby(key, "sent", sent)
+        pipe.hincrby(key, "failed", len(recipients) - sent)
+        pipe.hincrby(key, "chunks_done", 1)
+        pipe.execute()
+    logging.info("Mail job %s: chunk of %d sent (%d failed)", job_id, len(recipients), len(recipients) - sent)
+
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    # runs in the publishing process, the worker reads it back as task.request.enqueued_at
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+@task_success.connect
+def record_queue_latency(sender=None, **kwargs):
+    """Time from enqueue to a finished send, per queue, as histogram buckets in Redis"""
+    request = sender.request
+    enqueued_at = request.get("enqueued_at")
+    if not enqueued_at:
+        return
+
+    queue = (request.delivery_info or {}).get("routing_key") or Config.CELERY_TRANSACTIONAL_QUEUE
+    latency = time.time() - enqueued_at
+    key = queue_latency_key(queue)
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, "count", 1)
+            pipe.hincrbyfloat(key, "sum", latency)
+            for bucket in QUEUE_LATENCY_BUCKETS:
+                if latency <= bucket:
+                    pipe.hincrby(key, f"le_{bucket}", 1)
+            pipe.execute()
+    except RedisError as e:
+        logging.warning("Could not record queue latency: %s", e)
+
+
+@worker_process_init.connect
+def load_templates(**kwargs):
+    precompile_templates()
+
+
+@worker_process_shutdown.connect
+def close_smtp_pool(**kwargs):
+    smtp_pool.close_all()
+
+
+# when mails pile up in the API's publish queue, they go out as one batch over a single SMTP session;
+# sends with their own task id (idempotency key) or options are never coalesced
+task_dispatcher.coalesce(send_email, send_email_batch, Config.MAIL_BATCH_SIZE)
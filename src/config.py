@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import SecretStr
 from pathlib import Path
+from typing import Dict, List
 from dotenv import load_dotenv
 import os
 
@@ -14,11 +15,23 @@ class Settings(BaseSettings):
     DATABASE_URL: SecretStr = SecretStr(os.getenv("DATABASE_URL") or "")
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY") or ""
     JWT_ALGORITHM: str = "HS256"
+    JWT_CACHE_SIZE: int = 10000             # verified tokens kept per worker until they expire
+    JWT_MAX_LENGTH: int = 4096              # longer tokens are rejected before any parsing
+    JWT_REJECT_LOG_INTERVAL: float = 10.0   # at most one log line per interval for rejected tokens
     
     # Redis configuration
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 0.5
+    REDIS_CONNECT_TIMEOUT: float = 0.5
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    REDIS_WARM_CONNECTIONS: int = 4           # opened by each worker at startup
+    REDIS_CIRCUIT_THRESHOLD: int = 5          # failures in a row that open the circuit
+    REDIS_CIRCUIT_RESET_TIMEOUT: float = 5.0  # seconds before a trial call
+    REDIS_DEGRADED_TTL: float = 60.0          # how long a blocklist answer can be reused while Redis is down
+    REDIS_DEGRADED_CACHE_SIZE: int = 10000
 
     # Mail configuration
     MAIL_USERNAME: str = os.getenv("MAIL_USERNAME") or ""
@@ -33,6 +46,113 @@ class Settings(BaseSettings):
     VALIDATE_CERTS: bool = True
     DOMAIN: str = "localhost:8000"
     FRONTEND_URL: str = os.getenv("FRONTEND_URL") or "http://localhost:8501"
+    # "production" hides debugging headers such as X-DB-Queries and Server-Timing
+    ENVIRONMENT: str = "development"
+
+    # Database logging, echo prints every statement, the slow query log only the ones above the threshold
+    DB_ECHO: bool = False
+    SLOW_QUERY_MS: float = 200.0
+    SLOW_QUERY_MAX_FINGERPRINTS: int = 500
+
+    # SMTP sessions kept open by each Celery worker process
+    MAIL_POOL_SIZE: int = 2
+    MAIL_KEEPALIVE: float = 30.0
+    MAIL_TIMEOUT: float = 10.0
+    MAIL_MAX_MESSAGES_PER_CONNECTION: int = 100
+    MAIL_BATCH_SIZE: int = 50
+    MAIL_MAX_RETRIES: int = 5          # send_email and send_email_batch
+    MAIL_RETRY_DELAY: float = 30.0     # seconds, e.g. while the SMTP server refuses connections
+
+    # Bulk campaigns sent through /auth/send-mail
+    MAIL_BULK_CHUNK_SIZE: int = 500
+    MAIL_BULK_MAX_PER_SECOND: int = 10   # provider-wide, shared by all workers
+    MAIL_JOB_TTL: int = 7 * 24 * 3600
+
+    # Access log
+    ACCESS_LOG_SAMPLE_RATE: float = 1.0   # share of successful requests that get logged
+    ACCESS_LOG_SLOW_MS: float = 1000.0    # requests slower than this are always logged
+    ACCESS_LOG_BATCH_SIZE: int = 256
+    ACCESS_LOG_QUEUE_SIZE: int = 10000
+
+    # Per-worker concurrency limits, requests beyond limit + queue (or queued longer than the timeout) get a 503
+    CONCURRENCY_LIMIT: int = 64
+    CONCURRENCY_QUEUE_SIZE: int = 64
+    CONCURRENCY_EXPENSIVE_LIMIT: int = 8   # bcrypt and fan-out routes, roughly the CPU count
+    CONCURRENCY_EXPENSIVE_QUEUE_SIZE: int = 16
+    CONCURRENCY_QUEUE_TIMEOUT: float = 1.0
+    CONCURRENCY_RETRY_AFTER: int = 1
+    CONCURRENCY_EXPENSIVE_PATHS: List[str] = [
+        "/v2/auth/login", "/v2/auth/signup", "/v2/auth/password-reset-confirm", "/v2/auth/send-mail", "/v2/batch",
+    ]
+    CONCURRENCY_EXEMPT_PATHS: List[str] = ["/metrics"]
+
+    # Rate limits per user (or per client IP without a token), counted in Redis and per worker while it is down
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_LOGIN: str = "10/minute"
+    RATE_LIMIT_SIGNUP: str = "5/minute"
+    RATE_LIMIT_PASSWORD_RESET: str = "5/minute"
+    RATE_LIMIT_BOOKS: str = "120/minute"
+    RATE_LIMIT_REDIS_TIMEOUT: float = 0.1
+
+    # Single flight reads, SINGLE_FLIGHT_REDIS coalesces across workers through a Redis lock
+    SINGLE_FLIGHT_REDIS: bool = False
+    SINGLE_FLIGHT_LOCK_TTL: float = 2.0
+    SINGLE_FLIGHT_RESULT_TTL: float = 1.0
+    SINGLE_FLIGHT_POLL_INTERVAL: float = 0.01
+
+    # Service caches: a few seconds in process, CACHE_TTL in Redis, missing rows for CACHE_NEGATIVE_TTL
+    CACHE_TTL: float = 300.0
+    CACHE_LOCAL_TTL: float = 5.0
+    CACHE_LOCAL_SIZE: int = 1024
+    CACHE_NEGATIVE_TTL: float = 30.0
+    CACHE_TAG_TTL: int = 24 * 3600
+    CACHE_REDIS_TIMEOUT: float = 0.1
+    CACHE_RESUBSCRIBE_INTERVAL: float = 5.0
+
+    # Shared response cache for listings that only depend on the role, path -> invalidation tag
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_TTL: float = 30.0
+    RESPONSE_CACHE_ROUTES: Dict[str, str] = {"/v2/books/": "books", "/v2/review/": "reviews"}
+    RESPONSE_CACHE_ROLES: List[str] = ["admin", "user"]
+
+    # Listings skip the response_model validation and go straight to orjson for every client, not only
+    # for the ones asking for `fields=` or MessagePack
+    FAST_LISTINGS: bool = False
+
+    # Event loop lag, and with LOOP_DEBUG the stack and route of callbacks blocking the loop (asyncio loop only)
+    LOOP_LAG_INTERVAL: float = 0.25
+    LOOP_DEBUG: bool = False
+    LOOP_BLOCK_THRESHOLD: float = 0.1
+
+    # Server, see src/serve.py
+    SERVER_HOST: str = "127.0.0.1"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0                 # 0: one per CPU core
+    SERVER_BACKLOG: int = 2048
+    SERVER_KEEPALIVE: int = 5               # seconds an idle keep-alive connection stays open
+    SERVER_GRACEFUL_TIMEOUT: float = 30.0   # seconds the workers get to finish their requests on shutdown
+
+    # Batch endpoint
+    BATCH_MAX_REQUESTS: int = 20
+    BATCH_MAX_CONCURRENCY: int = 5
+
+    # Celery publishing from the API process
+    CELERY_PUBLISH_QUEUE_SIZE: int = 10000
+    CELERY_PUBLISH_TIMEOUT: float = 2.0
+    CELERY_RETRY_INTERVAL: float = 5.0
+    CELERY_RETRY_QUEUE_SIZE: int = 10000
+    CELERY_TRANSACTIONAL_QUEUE: str = "transactional"
+    CELERY_BULK_QUEUE: str = "bulk"
+
+    # Transactional outbox
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL: float = 1.0
+    OUTBOX_IDEMPOTENCY_TTL: int = 24 * 3600
+    # a row the broker refused waits OUTBOX_RETRY_DELAY seconds, doubling up to OUTBOX_MAX_RETRY_DELAY,
+    # and is parked after OUTBOX_MAX_ATTEMPTS failures (about an hour and a half of broker outage)
+    OUTBOX_RETRY_DELAY: float = 1.0
+    OUTBOX_MAX_RETRY_DELAY: float = 300.0
+    OUTBOX_MAX_ATTEMPTS: int = 25
 
     model_config = SettingsConfigDict(
         env_file=DOTENV_PATH,
@@ -46,5 +166,28 @@ Config = Settings()
 #Celery config
 broker_url = Config.REDIS_URL
 result_backend = Config.REDIS_URL
+# nothing reads task results, tasks that need one can still opt in with ignore_result=False
+task_ignore_result = True
 broker_connection_retry_on_startup = True
-worker_pool = "solo" if os.name == "nt" else None
\ No newline at end of file
+broker_connection_timeout = Config.CELERY_PUBLISH_TIMEOUT
+broker_transport_options = {
+    "socket_timeout": Config.CELERY_PUBLISH_TIMEOUT,
+    "socket_connect_timeout": Config.CELERY_PUBLISH_TIMEOUT,
+}
+worker_pool = "solo" if os.name == "nt" else None
+
+# password resets and verification mails have their own queue, so a bulk campaign can't hold them up.
+# run a worker per queue: -Q transactional / -Q bulk
+task_default_queue = Config.CELERY_TRANSACTIONAL_QUEUE
+task_queues = {
+    Config.CELERY_TRANSACTIONAL_QUEUE: {"exchange": Config.CELERY_TRANSACTIONAL_QUEUE, "routing_key": Config.CELERY_TRANSACTIONAL_QUEUE},
+    Config.CELERY_BULK_QUEUE: {"exchange": Config.CELERY_BULK_QUEUE, "routing_key": Config.CELERY_BULK_QUEUE},
+}
+task_routes = {
+    "src.celery_task.send_email": {"queue": Config.CELERY_TRANSACTIONAL_QUEUE},
+    "src.celery_task.send_email_batch": {"queue": Config.CELERY_TRANSACTIONAL_QUEUE},
+    "src.celery_task.send_bulk_chunk": {"queue": Config.CELERY_BULK_QUEUE},
+}
+# one message at a time per process, a long bulk chunk must not sit on prefetched mails
+worker_prefetch_multiplier = 1
+task_reject_on_worker_lost = True
@@ -0,0 +1,166 @@
+import re, threading, time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src.access_log import structured_logger
+from src.config import Config
+from src.request_context import RequestContext, current_request, request_context
+
+slow_query_logger = structured_logger("booklynn.slow_query")
+
+# literals and placeholders are stripped so the same query with different values shares a fingerprint
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"\$\d+|%s|%\(\w+\)s|(?<!:):\w+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """An endpoint or block of code ran more queries than its budget allows"""
+    pass
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Attribute every statement run on `engine` (count and time) to the request being served"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._query_start
+        ctx = current_request()
+        if ctx is not None:
+            ctx.db_queries += 1
+            ctx.db_time += duration
+        if duration * 1000 >= Config.SLOW_QUERY_MS:
+            record_slow_query(statement, duration, cursor.rowcount, ctx)
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> str:
+    """
+    The statement with its literals, placeholders and IN lists collapsed:
+
+        SELECT * FROM books WHERE uid = $1 AND pages > 100  ->  select * from books where uid = ? and pages > ?
+    """
+    normalized = _STRING.sub("?", statement)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _IN_LIST.sub("IN (...)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip().lower()
+
+
+@dataclass(slots=True)
+class SlowQueryStats:
+    fingerprint: str
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+    last_route: Optional[str] = None
+
+
+class SlowQueryLog:
+    """Slow queries of this process aggregated by fingerprint, the ones with the least total time are evicted first"""
+
+    def __init__(self, max_fingerprints: int):
+        self.max_fingerprints = max_fingerprints
+        self._stats: Dict[str, SlowQueryStats] = {}
+        # hooks run on the event loop and in to_thread workers alike
+        self._lock = threading.Lock()
+
+    def record(self, query: str, duration_ms: float, route: Optional[str]) -> None:
+        with self._lock:
+            stats = self._stats.get(query)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    del self._stats[min(self._stats.values(), key=lambda s: s.total_ms).fingerprint]
+                stats = self._stats[query] = SlowQueryStats(query)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.last_route = route
+
+    def top(self, limit: int) -> List[dict]:
+        with self._lock:
+            ranked = sorted(self._stats.values(), key=lambda s: s.total_ms, reverse=True)[:limit]
+            return [
+                {
+                    "fingerprint": s.fingerprint,
+                    "count": s.count,
+                    "total_ms": round(s.total_ms, 3),
+                    "avg_ms": round(s.total_ms / s.count, 3),
+                    "max_ms": round(s.max_ms, 3),
+                    "last_route": s.last_route,
+                }
+                for s in ranked
+            ]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+slow_queries = SlowQueryLog(Config.SLOW_QUERY_MAX_FINGERPRINTS)
+
+
+def record_slow_query(statement: str, duration: float, rowcount: int, ctx: Optional[RequestContext]) -> None:
+    query = fingerprint(statement)
+    duration_ms = round(duration * 1000, 3)
+    route = f"{ctx.method} {ctx.route or ctx.path}" if ctx is not None else None
+    slow_queries.record(query, duration_ms, route)
+    slow_query_logger.warning({
+        "event": "slow_query",
+        "fingerprint": query,
+        "duration_ms": duration_ms,
+        # drivers report -1 for a select whose rows have not been fetched yet
+        "rows": rowcount if rowcount >= 0 else None,
+        "route": route,
+    })
+
+
+def server_timing(ctx: RequestContext, total: float) -> str:
+    return f'db;dur={ctx.db_time * 1000:.1f};desc="{ctx.db_queries} queries", app;dur={total * 1000:.1f}'
+
+
+# Helpers for tests
+
+@contextmanager
+def query_budget(max_queries: int, label: str = "block") -> Iterator[RequestContext]:
+    """
+    Count the queries run inside the block and fail if there are more than `max_queries`:
+
+        with query_budget(3):
+            await book_service.get_all_books(session)
+    """
+    ctx = RequestContext(method="-", path=label)
+    token = request_context.set(ctx)
+    try:
+        yield ctx
+    finally:
+        request_context.reset(token)
+
+    if ctx.db_queries > max_queries:
+        raise QueryBudgetExceeded(f"{label} ran {ctx.db_queries} queries, the budget is {max_queries}")
+
+
+def assert_query_budget(response, max_queries: int) -> None:
+    """
+    Check an endpoint's query count from the X-DB-Queries header the middleware adds outside production:
+
+        response = await client.get("/v2/books/", headers=auth)
+        assert_query_budget(response, 4)
+    """
+    queries: Optional[str] = response.headers.get("x-db-queries")
+    if queries is None:
+        raise QueryBudgetExceeded("response has no X-DB-Queries header, is ENVIRONMENT set to production?")
+
+    request = getattr(response, "request", None)
+    label = f"{request.method} {request.url.path}" if request is not None else "response"
+    if int(queries) > max_queries:
+        raise QueryBudgetExceeded(f"{label} ran {queries} queries, the budget is {max_queries}")
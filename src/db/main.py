@@ -1,15 +1,51 @@
+import logging, time
+from contextlib import AsyncExitStack
 from sqlmodel import text
 from sqlalchemy.ext.asyncio import async_engine_from_config, async_session, create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from src.config import Config
+from src.metrics import DB_POOL, DB_POOL_WAIT
+from src.db.instrumentation import instrument_engine
 from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession as SQLModelAsyncSession
+from fastapi import Request
 from typing import AsyncGenerator
 
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """The default async queue pool, timing how long each checkout waits for a connection"""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+
+database_url = make_url(Config.DATABASE_URL.get_secret_value())
+# an in-memory sqlite db only lives as long as its single connection, it keeps sqlalchemy's default pool
+in_memory_db = database_url.get_backend_name() == "sqlite" and database_url.database in (None, "", ":memory:")
+
 async_engine = create_async_engine(
-    url=Config.DATABASE_URL.get_secret_value(),
-    echo=True
+    url=database_url,
+    echo=Config.DB_ECHO,
+    **({} if in_memory_db else {"poolclass": InstrumentedPool}),
 )
 
 
+def pool_status() -> dict:
+    pool = async_engine.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {("size",): pool.size(), ("checked_out",): pool.checkedout(), ("overflow",): max(pool.overflow(), 0)}
+
+
+DB_POOL.set_function(pool_status)
+
+# per-request query count and db time, see src/db/instrumentation.py
+instrument_engine(async_engine.sync_engine)
+
+
 async def initdb():
     """create a connection to our db"""
     # Import models here to avoid circular imports
@@ -22,14 +58,35 @@ async def initdb():
         # print(result)
 
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    from sqlmodel.ext.asyncio.session import AsyncSession
-    async_session = async_sessionmaker(
-        bind=async_engine, 
-        class_=AsyncSession,
-        expire_on_commit=False
-    )
-    
+async def warm_pool() -> None:
+    """Open the pool's connections before the worker takes traffic, so the first requests don't pay for them"""
+    pool = async_engine.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        return
+    try:
+        # all checked out at once, so each one is a new connection
+        async with AsyncExitStack() as stack:
+            for _ in range(pool.size()):
+                conn = await stack.enter_async_context(async_engine.connect())
+                await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        logging.warning("Could not open the database pool at startup: %s", e)
+
+
+async_session = async_sessionmaker(
+    bind=async_engine,
+    class_=SQLModelAsyncSession,
+    expire_on_commit=False
+)
+
+
+async def get_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    # sequential sub-requests of a batch run on the batch's own session
+    shared_session = getattr(request.state, "shared_session", None)
+    if shared_session is not None:
+        yield shared_session
+        return
+
     async with async_session() as session:
         yield session
 
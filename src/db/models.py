@@ -1,7 +1,7 @@
 from sqlmodel import SQLModel, Field, Column, Relationship
 import uuid, enum
 from datetime import datetime
-from sqlalchemy import Enum, String, DateTime, ForeignKey, func
+from sqlalchemy import Enum, String, DateTime, ForeignKey, JSON, func
 from typing import List, Optional
 
 #created db model, with user_accounts, books, reviews table
@@ -106,5 +106,21 @@ class Review(SQLModel, table=True):
         return f"<Review for book {self.book_uid} by user {self.user_uid}>"
 
 
+class OutboxMessage(SQLModel, table=True):
+    """Celery task written in the same transaction as the rows it belongs to, relayed to the broker afterwards"""
+    __tablename__: str = "outbox_messages"
 
+    uid: str = Field(sa_column=Column(String(36), primary_key=True, nullable=False, default=lambda: str(uuid.uuid4())))
 
+    # used as the celery task id, so the worker can drop a message that was relayed twice
+    idempotency_key: str = Field(sa_column=Column(String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4())))
+    task_name: str = Field(sa_column=Column(String(255), nullable=False))
+    payload: dict = Field(sa_column=Column(JSON, nullable=False))
+    # failed relays so far; the relay backs off until next_attempt_at and parks the row after OUTBOX_MAX_ATTEMPTS
+    attempts: int = Field(default=0)
+    next_attempt_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime, nullable=True))
+
+    created_at: datetime = Field(sa_column=Column(DateTime, default=datetime.now, index=True))
+
+    def __repr__(self) -> str:
+        return f"<OutboxMessage {self.task_name} {self.idempotency_key}>"
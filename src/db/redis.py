@@ -1,14 +1,262 @@
+import asyncio, logging, math, time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
 import redis.asyncio as redis
+from redis.exceptions import RedisError
 from src.config import Config
+from src.errors import RedisUnavailable
+from src.metrics import REDIS_CIRCUIT, REDIS_DEGRADED, REDIS_LATENCY, QUEUE_LATENCY_BUCKETS
 
-JTI_EXPIRY = 3600
+T = TypeVar("T")
 
-# Async Redis client using redis-py
-token_blocklist = redis.from_url(Config.REDIS_URL)
 
-async def add_jti_to_blocklist(jti: str) -> None:
-    await token_blocklist.set(name=jti, value="", ex=JTI_EXPIRY)
+class CircuitBreaker:
+    """
+    Closed: calls go through. After `threshold` failures in a row it opens and calls fail at once for
+    `reset_timeout` seconds, then one trial call is let through (half open): success closes it, failure reopens it.
+    A trial that never reports back (cancelled, or lost) is replaced by a new one after another `reset_timeout`.
+    """
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
 
-async def token_in_blocklist(jti: str) -> bool:
-    result = await token_blocklist.get(jti)
-    return result is not None
\ No newline at end of file
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at = 0.0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if (self.state == self.OPEN and now - self.opened_at >= self.reset_timeout) or \
+                (self.state == self.HALF_OPEN and now - self.trial_at >= self.reset_timeout):
+            self.state = self.HALF_OPEN
+            self.trial_at = now
+            return True
+        return self.state == self.CLOSED
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logging.warning("Redis circuit open after %d failures", self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ManagedRedis:
+    """
+    The API's Redis client: one bounded connection pool with socket timeouts and health checks, opened and
+    closed by the lifespan, behind a circuit breaker. Every command goes through `execute`, which raises
+    RedisUnavailable right away while the circuit is open instead of waiting on a stalled server.
+    """
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.breaker = CircuitBreaker(Config.REDIS_CIRCUIT_THRESHOLD, Config.REDIS_CIRCUIT_RESET_TIMEOUT)
+        self._client: Optional[redis.Redis] = None
+        self._pubsub_client: Optional[redis.Redis] = None
+
+    @property
+    def client(self) -> redis.Redis:
+        # created on first use too, for code running without the lifespan (scripts, tests)
+        if self._client is None:
+            pool = redis.ConnectionPool.from_url(
+                self.url,
+                max_connections=Config.REDIS_MAX_CONNECTIONS,
+                socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT,
+                health_check_interval=Config.REDIS_HEALTH_CHECK_INTERVAL,
+            )
+            self._client = redis.Redis(connection_pool=pool)
+        return self._client
+
+    def pubsub(self) -> "redis.client.PubSub":
+        """
+        A pub/sub on a connection of its own without socket timeout: an idle channel is not an error.
+        Liveness comes from the health check, which get_message runs every REDIS_HEALTH_CHECK_INTERVAL.
+        """
+        if self._pubsub_client is None:
+            self._pubsub_client = redis.Redis.from_url(
+                self.url,
+                socket_timeout=None,
+                socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT,
+                health_check_interval=Config.REDIS_HEALTH_CHECK_INTERVAL,
+            )
+        return self._pubsub_client.pubsub()
+
+    async def open(self) -> None:
+        # concurrent pings each check out a connection, so the pool starts with REDIS_WARM_CONNECTIONS open
+        results = await asyncio.gather(
+            *(self.execute(lambda client: client.ping()) for _ in range(Config.REDIS_WARM_CONNECTIONS)), return_exceptions=True
+        )
+        if any(isinstance(result, RedisUnavailable) for result in results):
+            logging.warning("Redis is not reachable at startup, running degraded")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._pubsub_client is not None:
+            await self._pubsub_client.aclose()
+            self._pubsub_client = None
+
+    async def execute(self, command: Callable[[redis.Redis], Awaitable[T]]) -> T:
+        if not self.breaker.allow():
+            raise RedisUnavailable()
+        try:
+            result = await command(self.client)
+        except (RedisError, OSError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise RedisUnavailable() from e
+        except BaseException:
+            # a trial call that was cancelled or failed otherwise proves nothing, back to open until the next one
+            if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+
+redis_client = ManagedRedis(Config.REDIS_URL)
+REDIS_CIRCUIT.set_function(lambda: {(): redis_client.breaker.state})
+
+
+# Token revocation. A revoked JTI is kept until the token would have expired anyway, and "log out everywhere"
+# stores one epoch per user: tokens issued (`iat`) before it are revoked, without listing their JTIs.
+# Recent answers are kept locally, so sessions seen in the last REDIS_DEGRADED_TTL seconds keep working while
+# Redis is down, other tokens are refused with a 503 (RedisUnavailable) rather than let through.
+
+JTI_EXPIRY = 3600                # for tokens without an exp claim
+SESSION_EPOCH_TTL = 7 * 86400    # the refresh token lifetime, older tokens are expired anyway
+
+recent_checks: "OrderedDict[str, tuple]" = OrderedDict()
+# epochs set by this worker, honoured even if Redis did not get them
+local_epochs: "OrderedDict[str, float]" = OrderedDict()
+
+def remember(cache: OrderedDict, key: str, value) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > Config.REDIS_DEGRADED_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def remember_check(jti: str, revoked: bool) -> None:
+    remember(recent_checks, jti, (revoked, time.monotonic()))
+
+def session_epoch_key(user_uid: str) -> str:
+    return f"session_epoch:{user_uid}"
+
+def blocklist_ttl(token_data: dict) -> int:
+    """Seconds until the token expires, 0 if it already has"""
+    exp = token_data.get("exp")
+    if exp is None:
+        return JTI_EXPIRY
+    return max(math.ceil(exp - time.time()), 0)
+
+async def revoke_tokens(tokens: Iterable[dict]) -> None:
+    """Blocklist the decoded tokens in one round trip, each until its own expiry"""
+    revoked = [(token_data["jti"], blocklist_ttl(token_data)) for token_data in tokens]
+    revoked = [(jti, ttl) for jti, ttl in revoked if ttl > 0]
+    if not revoked:
+        return
+    for jti, _ in revoked:
+        # this worker honours the revocation even if Redis does not get it
+        remember_check(jti, True)
+
+    async def write(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for jti, ttl in revoked:
+                pipe.set(name=jti, value="", ex=ttl)
+            await pipe.execute()
+
+    with REDIS_LATENCY.time("pipeline"):
+        await redis_client.execute(write)
+
+async def revoke_all_sessions(user_uid: str) -> None:
+    """Revoke every token of the user issued until now"""
+    epoch = time.time()
+    remember(local_epochs, user_uid, epoch)
+    with REDIS_LATENCY.time("set"):
+        await redis_client.execute(lambda client: client.set(session_epoch_key(user_uid), epoch, ex=SESSION_EPOCH_TTL))
+
+async def token_revoked(token_data: dict) -> bool:
+    """Whether the decoded token was blocklisted or issued before its user's session epoch"""
+    jti = token_data["jti"]
+    user_uid = token_data.get("user", {}).get("user_uid")
+    # tokens issued before iat was added count as issued at 0
+    issued_at = token_data.get("iat", 0)
+    if user_uid in local_epochs and issued_at < local_epochs[user_uid]:
+        return True
+
+    keys = [jti] + ([session_epoch_key(user_uid)] if user_uid else [])
+    try:
+        with REDIS_LATENCY.time("mget"):
+            values = await redis_client.execute(lambda client: client.mget(keys))
+    except RedisUnavailable:
+        recent = recent_checks.get(jti)
+        if recent is None or time.monotonic() - recent[1] > Config.REDIS_DEGRADED_TTL:
+            raise
+        REDIS_DEGRADED.inc()
+        return recent[0]
+
+    revoked = values[0] is not None or (len(values) > 1 and values[1] is not None and issued_at < float(values[1]))
+    remember_check(jti, revoked)
+    return revoked
+
+
+# Progress of bulk mail jobs, the Celery workers update the same hash
+
+def mail_job_key(job_id: str) -> str:
+    return f"mailjob:{job_id}"
+
+async def create_mail_job(job_id: str, recipients: int, chunks: int) -> None:
+    key = mail_job_key(job_id)
+    async def create(client):
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={"recipients": recipients, "chunks": chunks, "chunks_done": 0, "chunks_failed": 0, "sent": 0, "failed": 0})
+            pipe.expire(key, Config.MAIL_JOB_TTL)
+            await pipe.execute()
+
+    with REDIS_LATENCY.time("pipeline"):
+        await redis_client.execute(create)
+
+async def get_mail_job(job_id: str) -> dict | None:
+    with REDIS_LATENCY.time("hgetall"):
+        job = await redis_client.execute(lambda client: client.hgetall(mail_job_key(job_id)))
+    if not job:
+        return None
+    return {key.decode(): int(val) for key, val in job.items()}
+
+
+# Celery queue metrics: depth is the broker list itself, latency buckets are written by the workers
+
+def queue_latency_key(queue: str) -> str:
+    return f"celery:latency:{queue}"
+
+async def get_queue_stats(queues: list[str]) -> dict:
+    async def read(client):
+        async with client.pipeline(transaction=False) as pipe:
+            for queue in queues:
+                pipe.llen(queue)
+                pipe.hgetall(queue_latency_key(queue))
+            return await pipe.execute()
+
+    with REDIS_LATENCY.time("pipeline"):
+        results = await redis_client.execute(read)
+
+    stats = {}
+    for queue, depth, latency in zip(queues, results[::2], results[1::2]):
+        latency = {key.decode(): float(val) for key, val in latency.items()}
+        count = int(latency.get("count", 0))
+        stats[queue] = {
+            "depth": depth,
+            "sent": count,
+            "latency_sum": latency.get("sum", 0.0),
+            "avg_latency": latency.get("sum", 0.0) / count if count else None,
+            "latency_buckets": {str(bucket): int(latency.get(f"le_{bucket}", 0)) for bucket in QUEUE_LATENCY_BUCKETS},
+        }
+    return stats
@@ -0,0 +1,187 @@
+import logging, queue, threading, time, uuid
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from src.config import Config
+from src.metrics import CELERY_ENQUEUE_LATENCY, CELERY_PUBLISH_PENDING
+
+# sentinel telling the publisher thread to finish
+_STOP = object()
+
+
+class TaskDispatcher:
+    """
+    Publishes Celery tasks from a dedicated thread, so async handlers never wait on the broker.
+    Messages the broker refuses are kept in a local retry queue and published again once it is reachable.
+    """
+    def __init__(self, maxsize: int, publish_timeout: float, retry_interval: float, retry_maxsize: int) -> None:
+        self.publish_timeout = publish_timeout
+        self.retry_interval = retry_interval
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self._retry: Deque[Tuple[Any, Dict[str, Any]]] = deque(maxlen=retry_maxsize)
+        self._thread: Optional[threading.Thread] = None
+        # guards the retry queue too, the event loop thread adds to it while the publisher thread drains it
+        self._lock = threading.Lock()
+        self._last_retry = 0.0
+        # task name -> (batch task, max batch size)
+        self._batches: Dict[str, Tuple[Any, int]] = {}
+        # item pulled from the queue while batching that belongs to the next round
+        self._carry: Any = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="celery-publisher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Flush what is queued and stop the publisher thread, blocks up to `timeout` seconds"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logging.warning("Celery publish queue still full at shutdown")
+        thread.join(timeout)
+
+        if self._retry:
+            logging.warning("%d task(s) left unpublished in the retry queue at shutdown", len(self._retry))
+
+    def coalesce(self, task, batch_task, max_size: int) -> None:
+        """
+        When several calls of `task` are waiting to be published, send them as one `batch_task`
+        call whose only argument is the list of their positional arguments, each prefixed with a new id
+        that `batch_task` can use as the call's idempotency key. Calls with apply_async options, keyword
+        arguments or a task id of their own are published as they are.
+        """
+        self._batches[task.name] = (batch_task, max_size)
+
+    def enqueue(self, task, *args, **kwargs) -> bool:
+        """Queue `task.delay(*args, **kwargs)` for publishing, never blocks"""
+        return self.enqueue_signature(task.s(*args, **kwargs))
+
+    def enqueue_signature(self, signature, **options) -> bool:
+        """Queue any Celery signature (task, group, chain...) for publishing with the given apply_async options"""
+        self.start()
+        try:
+            self._queue.put_nowait((signature, options))
+            return True
+        except queue.Full:
+            logging.warning("Celery publish queue is full, moving task to the retry queue")
+            self._keep_for_retry((signature, options))
+            return False
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() + len(self._retry)
+
+    def _run(self) -> None:
+        while True:
+            if self._carry is not None:
+                item, self._carry = self._carry, None
+            else:
+                try:
+                    item = self._queue.get(timeout=self.retry_interval if self._retry else None)
+                except queue.Empty:
+                    item = None
+
+            if item is _STOP:
+                self._drain_queue()
+                self._drain_retry()
+                return
+
+            if item is not None:
+                item = self._batch(item)
+                if self._retry:
+                    # broker is known to be down, keep the order and don't pay a timeout per message
+                    self._keep_for_retry(item)
+                elif not self._publish(item):
+                    self._keep_for_retry(item)
+
+            if self._retry and time.monotonic() - self._last_retry >= self.retry_interval:
+                self._drain_retry()
+
+    def _batch(self, item: Tuple[Any, Dict[str, Any]]) -> Tuple[Any, Dict[str, Any]]:
+        signature, options = item
+        batch = self._batches.get(getattr(signature, "task", None))
+        if batch is None or not self._coalescable(item):
+            return item
+
+        batch_task, max_size = batch
+        calls = [[uuid.uuid4().hex, *signature.args]]
+        while len(calls) < max_size:
+            try:
+                nxt = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is _STOP or getattr(nxt[0], "task", None) != signature.task or not self._coalescable(nxt):
+                self._carry = nxt
+                break
+            calls.append([uuid.uuid4().hex, *nxt[0].args])
+
+        if len(calls) == 1:
+            return item
+        return batch_task.s(calls), {}
+
+    @staticmethod
+    def _coalescable(item: Tuple[Any, Dict[str, Any]]) -> bool:
+        signature, options = item
+        return not options and not signature.kwargs and not signature.options.get("task_id")
+
+    def _publish(self, item: Tuple[Any, Dict[str, Any]]) -> bool:
+        signature, options = item
+        try:
+            # nobody waits on these results, so don't make the publish touch the result backend either
+            with CELERY_ENQUEUE_LATENCY.time(getattr(signature, "name", None) or "group"):
+                signature.apply_async(retry=False, timeout=self.publish_timeout, **{"ignore_result": True, **options})
+            return True
+        except Exception as e:
+            logging.warning("Publishing %s to the broker failed: %s", getattr(signature, "name", signature), e)
+            return False
+
+    def _keep_for_retry(self, item: Tuple[Any, Dict[str, Any]], oldest: bool = False) -> None:
+        """
+        Queue `item` for the next retry, at the back, or at the front when it is the `oldest` (a retry that
+        failed again). A full queue drops its oldest task, which is then `item` itself in the second case.
+        """
+        with self._lock:
+            if len(self._retry) == self._retry.maxlen:
+                dropped = item if oldest else self._retry.popleft()
+                logging.error("Celery retry queue is full, dropping the oldest task %s", getattr(dropped[0], "name", dropped[0]))
+                if oldest:
+                    return
+            if oldest:
+                self._retry.appendleft(item)
+            else:
+                self._retry.append(item)
+
+    def _drain_queue(self) -> None:
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP and (self._retry or not self._publish(item)):
+                self._keep_for_retry(item)
+
+    def _drain_retry(self) -> None:
+        self._last_retry = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._retry:
+                    return
+                item = self._retry.popleft()
+            if not self._publish(item):
+                self._keep_for_retry(item, oldest=True)
+                return
+
+
+task_dispatcher = TaskDispatcher(
+    maxsize=Config.CELERY_PUBLISH_QUEUE_SIZE,
+    publish_timeout=Config.CELERY_PUBLISH_TIMEOUT,
+    retry_interval=Config.CELERY_RETRY_INTERVAL,
+    retry_maxsize=Config.CELERY_RETRY_QUEUE_SIZE,
+)
+
+CELERY_PUBLISH_PENDING.set_function(lambda: {(): task_dispatcher.pending})
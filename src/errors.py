@@ -4,7 +4,7 @@ from fastapi.requests import Request
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import SQLAlchemyError
 
-__all__ = ["BookNotFound", "UserNotFound", "InvalidToken","RefreshTokenRequired","AccessTokenRequired","RevokedToken","InvalidCredentials","UserAlreadyExists","AccountNotVerified", "InsufficientPermission"]
+__all__ = ["BookNotFound", "UserNotFound", "InvalidToken","RefreshTokenRequired","AccessTokenRequired","RevokedToken","InvalidCredentials","UserAlreadyExists","AccountNotVerified", "InsufficientPermission", "InvalidFields", "RateLimitExceeded", "RedisUnavailable"]
 
 class BooklynnException(Exception):
     """This is the base class for all Booklynn errors"""
@@ -52,6 +52,20 @@ class InsufficientPermission(BooklynnException):
     """User does not have the neccessary permissions to perform an action."""
     pass
 
+class InvalidFields(BooklynnException):
+    """User has asked for fields that are not part of the listing's schema."""
+    pass
+
+class RateLimitExceeded(BooklynnException):
+    """User has sent more requests than the route's rate limit allows."""
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+class RedisUnavailable(BooklynnException):
+    """Redis is down or its circuit breaker is open, and the request cannot be served without it."""
+    pass
+
 def create_exception_handler(
     status_code: int, initial_detail: Any
 ) -> Callable[[Request, Exception], JSONResponse]:
@@ -180,6 +194,42 @@ def register_all_errors(app: FastAPI):
         ),
     )
 
+    app.add_exception_handler(
+        InvalidFields,
+        create_exception_handler(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            initial_detail={
+                "message": "Unknown field requested",
+                "resolution": "Pass a comma separated list of fields from the response schema, e.g. fields=uid,title,author",
+                "error_code": "invalid_fields",
+            },
+        ),
+    )
+
+    app.add_exception_handler(
+        RedisUnavailable,
+        create_exception_handler(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            initial_detail={
+                "message": "Service temporarily unavailable",
+                "resolution": "Please try again shortly",
+                "error_code": "service_unavailable",
+            },
+        ),
+    )
+
+    @app.exception_handler(RateLimitExceeded)
+    async def rate_limit_exceeded(request, exc: RateLimitExceeded):
+        return JSONResponse(
+            content={
+                "message": "Too many requests",
+                "resolution": f"Please retry in {exc.retry_after} seconds",
+                "error_code": "rate_limit_exceeded",
+            },
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
     @app.exception_handler(500)
     async def internal_server_error(request, exc):
 
@@ -0,0 +1,103 @@
+import asyncio, logging, sys, threading, time, traceback
+from typing import Optional, Tuple
+from src.access_log import structured_logger
+from src.config import Config
+from src.metrics import LOOP_BLOCKED, LOOP_LAG
+from src.request_context import request_context
+
+loop_logger = structured_logger("booklynn.loop")
+
+# (handle, start) of the callback the loop is running right now, set by the patched Handle._run in debug mode
+_running: Optional[Tuple[asyncio.Handle, float]] = None
+_original_run = asyncio.Handle._run
+
+
+def _timed_run(self: asyncio.Handle) -> None:
+    global _running
+    _running = (self, time.perf_counter())
+    try:
+        _original_run(self)
+    finally:
+        _running = None
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag in the background of each API worker: a task sleeps `interval` seconds and records
+    how late it wakes up in `event_loop_lag_seconds`. Anything running synchronously on the loop (bcrypt, a
+    blocking client, print to a slow pipe) shows up there.
+
+    With LOOP_DEBUG it also finds the culprit: every callback the loop runs (a step of a coroutine, mostly) is
+    timestamped, and a watchdog thread that sees one running longer than `block_threshold` logs the loop thread's
+    stack at that moment and the route of the request it belongs to. This needs asyncio's own loop, not uvloop.
+    """
+
+    def __init__(self, interval: float, block_threshold: float, debug: bool) -> None:
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.debug = debug
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._task = loop.create_task(self._measure(), name="loop-monitor")
+        if not self.debug:
+            return
+        if not isinstance(loop, asyncio.BaseEventLoop):
+            logging.warning("Blocking call detection needs the asyncio event loop, not %s", type(loop).__name__)
+            return
+        asyncio.Handle._run = _timed_run
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, args=(threading.get_ident(),), name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._watchdog is not None:
+            self._stop.set()
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+            asyncio.Handle._run = _original_run
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(loop.time() - start - self.interval, 0.0))
+
+    def _watch(self, loop_thread: int) -> None:
+        reported = None
+        while not self._stop.wait(self.block_threshold / 2):
+            running = _running
+            if running is None or running is reported:
+                continue
+            handle, start = running
+            blocked = time.perf_counter() - start
+            if blocked < self.block_threshold:
+                continue
+
+            # once per blocking callback, however long it goes on
+            reported = running
+            frame = sys._current_frames().get(loop_thread)
+            ctx = handle._context.get(request_context) if handle._context is not None else None
+            route = f"{ctx.method} {ctx.route or ctx.path}" if ctx is not None else None
+            LOOP_BLOCKED.inc(route or "")
+            loop_logger.warning({
+                "event": "loop_blocked",
+                "blocked_ms": round(blocked * 1000, 3),
+                "route": route,
+                "callback": repr(handle),
+                "stack": traceback.format_stack(frame) if frame is not None else None,
+            })
+
+
+loop_monitor = LoopMonitor(Config.LOOP_LAG_INTERVAL, Config.LOOP_BLOCK_THRESHOLD, Config.LOOP_DEBUG)
@@ -1,32 +1,64 @@
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from functools import lru_cache
 from src.config import Config
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List
 
 BASE_DIR = Path(__file__).resolve().parent
+TEMPLATE_FOLDER = Path(BASE_DIR, "templates")
 
-mail_config = ConnectionConfig(
-    MAIL_USERNAME=Config.MAIL_USERNAME,
-    MAIL_PASSWORD=Config.MAIL_PASSWORD,
-    MAIL_FROM=Config.MAIL_FROM,
-    MAIL_PORT=587,
-    MAIL_SERVER=Config.MAIL_SERVER,
-    MAIL_FROM_NAME=Config.MAIL_FROM_NAME,
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(BASE_DIR, "templates"),
-)
 
+# fastapi_mail (and the httpx and dns stack it pulls in) is only imported by code that sends with it,
+# the API and the Celery workers render templates and go through src/smtp_pool.py instead
+
+@lru_cache(maxsize=None)
+def get_mail():
+    from fastapi_mail import FastMail, ConnectionConfig
 
-mail = FastMail(config=mail_config)
+    mail_config = ConnectionConfig(
+        MAIL_USERNAME=Config.MAIL_USERNAME,
+        MAIL_PASSWORD=Config.MAIL_PASSWORD,
+        MAIL_FROM=Config.MAIL_FROM,
+        MAIL_PORT=587,
+        MAIL_SERVER=Config.MAIL_SERVER,
+        MAIL_FROM_NAME=Config.MAIL_FROM_NAME,
+        MAIL_STARTTLS=True,
+        MAIL_SSL_TLS=False,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TEMPLATE_FOLDER=TEMPLATE_FOLDER,
+    )
+    return FastMail(config=mail_config)
 
 
 def create_message(recipients: List[str], subject: str, body: str):
+    from fastapi_mail import MessageSchema, MessageType
+
     message = MessageSchema(
         recipients=recipients, subject=subject, body=body, subtype=MessageType.html
     )
     return message
 
 
+# Email templates, tasks carry only the template name and its context and the worker renders them.
+# auto_reload is off, so each template is compiled once per process and never stat'ed again.
+templates = Environment(
+    loader=FileSystemLoader(TEMPLATE_FOLDER),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    cache_size=-1,
+)
+
+
+def precompile_templates() -> None:
+    """Compile every template up front, called when a worker process starts"""
+    for name in templates.list_templates():
+        templates.get_template(name)
+
+
+def render_template(name: str, context: Dict[str, Any] | None = None) -> str:
+    """
+    Render a template by name. The output is not cached: verification and reset mails carry a unique signed
+    link, and a bulk chunk renders its body once for all its recipients.
+    """
+    return templates.get_template(name).render(context or {})
@@ -0,0 +1,188 @@
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# seconds, covers a cache hit up to a slow bcrypt or SMTP call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# enqueue -> sent latency of Celery tasks, the workers record into these same buckets
+QUEUE_LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    """
+    Base class of the metric types. Recording is a dict lookup and an add, with no locks: the event loop
+    is single threaded and the few background threads that record only risk a lost increment under the GIL.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """The exposition lines of the metric, one per label set (and bucket)"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self) -> Iterator[str]:
+        for labelvalues, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        self._values[labelvalues] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) - amount
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """Read the values at scrape time instead, `function` returns {labelvalues: value}"""
+        self._function = function
+
+    def samples(self) -> Iterator[str]:
+        values = self._function() if self._function is not None else self._values
+        for labelvalues, value in list(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [count in each bucket (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        data = self._values.get(labelvalues)
+        if data is None:
+            data = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        data = self._values.get(labelvalues)
+        return int(sum(data[:-1])) if data else 0
+
+    def set_raw(self, labelvalues: Tuple[str, ...], cumulative: Sequence[float], total: float) -> None:
+        """Replace a label set with cumulative bucket counts gathered elsewhere (e.g. by the Celery workers)"""
+        data = [0] * (len(self.buckets) + 2)
+        previous = 0
+        for idx, count in enumerate(cumulative):
+            data[idx] = count - previous
+            previous = count
+        data[-1] = total
+        self._values[labelvalues] = data
+
+    def samples(self) -> Iterator[str]:
+        for labelvalues, data in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data[:-1]):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                yield f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}"
+            yield f"{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {data[-1]}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+# HTTP
+REQUEST_LATENCY = registry.register(Histogram("http_request_duration_seconds", "Request latency by route template and status", ["method", "route", "status"]))
+REQUESTS_IN_FLIGHT = registry.register(Gauge("http_requests_in_flight", "Requests being served by this worker"))
+LOOP_LAG = registry.register(Histogram("event_loop_lag_seconds", "How late the event loop runs a timer, time spent in synchronous code", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+LOOP_BLOCKED = registry.register(Counter("event_loop_blocked_total", "Callbacks that held the event loop longer than LOOP_BLOCK_THRESHOLD (LOOP_DEBUG only)", ["route"]))
+CONCURRENCY_POOL = registry.register(Gauge("http_concurrency_pool", "Limit, in-flight and queued requests of each concurrency pool", ["pool", "state"]))
+REQUESTS_SHED = registry.register(Counter("http_requests_shed_total", "Requests answered 503 because their concurrency pool was full", ["pool"]))
+RATE_LIMITED = registry.register(Counter("http_requests_rate_limited_total", "Requests answered 429 by each rate limit", ["scope"]))
+
+# Database pool
+DB_POOL_WAIT = registry.register(Histogram("db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection"))
+DB_POOL = registry.register(Gauge("db_pool_connections", "Connections of the DB pool by state", ["state"]))
+
+# Redis
+REDIS_LATENCY = registry.register(Histogram("redis_command_duration_seconds", "Redis call latency", ["command"]))
+REDIS_CIRCUIT = registry.register(Gauge("redis_circuit_state", "Redis circuit breaker: 0 closed, 1 open, 2 half open"))
+REDIS_DEGRADED = registry.register(Counter("redis_degraded_answers_total", "Blocklist checks answered from the local cache while Redis was down"))
+
+# Celery
+CELERY_ENQUEUE_LATENCY = registry.register(Histogram("celery_enqueue_duration_seconds", "Time to publish a task to the broker", ["task"]))
+CELERY_PUBLISH_PENDING = registry.register(Gauge("celery_publish_pending", "Tasks waiting in this worker's publish and retry queues"))
+CELERY_QUEUE_DEPTH = registry.register(Gauge("celery_queue_depth", "Messages waiting in each Celery queue", ["queue"]))
+CELERY_QUEUE_LATENCY = registry.register(Histogram("celery_queue_latency_seconds", "Time from enqueue to a finished send, recorded by the workers", ["queue"], buckets=QUEUE_LATENCY_BUCKETS))
+
+# Coalesced reads, a miss runs the call, a hit shares one running in this worker, a remote hit one from another worker
+SINGLE_FLIGHT = registry.register(Counter("single_flight_calls_total", "Single flight lookups by outcome", ["name", "result"]))
+
+# Caches, by tier: a local miss goes on to Redis
+CACHE_REQUESTS = registry.register(Counter("cache_requests_total", "Cache lookups by cache, tier and result", ["cache", "tier", "result"]))
+
+# Password hashing and tokens
+BCRYPT_LATENCY = registry.register(Histogram("bcrypt_duration_seconds", "Time spent hashing or checking passwords", ["operation"], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+TOKENS_REJECTED = registry.register(Counter("jwt_rejected_total", "Bearer tokens that failed decoding, by reason", ["reason"]))
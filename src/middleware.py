@@ -1,24 +1,174 @@
 from fastapi import FastAPI
 from fastapi.requests import Request
-import time, logging
+from fastapi.responses import JSONResponse
+import asyncio, time, logging, random
+from typing import Dict, Sequence
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from src.access_log import structured_logger
+from src.response_cache import ResponseCacheMiddleware
+from src.config import Config
+from src.metrics import CONCURRENCY_POOL, REQUEST_LATENCY, REQUESTS_IN_FLIGHT, REQUESTS_SHED
+from src.request_context import RequestContext, request_context
+from src.db.instrumentation import server_timing
 
 logger = logging.getLogger("uvicorn.access")
 logger.disabled = True
 
+# structured access log, one JSON line per request written from a background thread
+access_logger = structured_logger("booklynn.access")
+
+
+class ConcurrencyPool:
+    """At most `limit` requests at once, `queue_size` more may wait up to `timeout` seconds for a slot"""
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+        elif self.waiting >= self.queue_size:
+            return False
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Sheds load before it piles up on the DB pool: every request takes a slot from its pool, the expensive
+    pool for writes to `expensive_paths` (bcrypt, fan-out), the default one otherwise, and gets a 503 with
+    Retry-After right away when the pool and its wait queue are full.
+    Batch sub-requests run inside their parent's slot and exempt paths (metrics) are never limited.
+    """
+
+    def __init__(self, app, pools: Dict[str, ConcurrencyPool], expensive_paths: Sequence[str], exempt_paths: Sequence[str], retry_after: int) -> None:
+        self.app = app
+        self.pools = pools
+        self.expensive_paths = tuple(expensive_paths)
+        self.exempt_paths = tuple(exempt_paths)
+        self.retry_after = retry_after
+        CONCURRENCY_POOL.set_function(self.pool_status)
+
+    def pool_for(self, scope) -> ConcurrencyPool:
+        if scope["method"] not in ("GET", "HEAD", "OPTIONS") and scope["path"].startswith(self.expensive_paths):
+            return self.pools["expensive"]
+        return self.pools["default"]
+
+    def pool_status(self) -> dict:
+        status = {}
+        for name, pool in self.pools.items():
+            status[(name, "limit")] = pool.limit
+            status[(name, "in_flight")] = pool.in_flight
+            status[(name, "waiting")] = pool.waiting
+        return status
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("state", {}).get("batch") or scope["path"].startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+
+        pool = self.pool_for(scope)
+        if not await pool.acquire():
+            REQUESTS_SHED.inc(pool.name)
+            response = JSONResponse(
+                content={"message": "Server is busy, please retry shortly", "error_code": "server_overloaded"},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool.release()
+
+
 def register_middleware(app: FastAPI):
 
+    # added first so it runs inside the access log middleware, shed requests are logged and measured too
+    app.add_middleware(
+        ConcurrencyLimitMiddleware,
+        pools={
+            "default": ConcurrencyPool("default", Config.CONCURRENCY_LIMIT, Config.CONCURRENCY_QUEUE_SIZE, Config.CONCURRENCY_QUEUE_TIMEOUT),
+            "expensive": ConcurrencyPool("expensive", Config.CONCURRENCY_EXPENSIVE_LIMIT, Config.CONCURRENCY_EXPENSIVE_QUEUE_SIZE, Config.CONCURRENCY_QUEUE_TIMEOUT),
+        },
+        expensive_paths=Config.CONCURRENCY_EXPENSIVE_PATHS,
+        exempt_paths=Config.CONCURRENCY_EXEMPT_PATHS,
+        retry_after=Config.CONCURRENCY_RETRY_AFTER,
+    )
+
+    # outside the concurrency limit, a cached listing costs next to nothing
+    if Config.RESPONSE_CACHE_ENABLED:
+        app.add_middleware(
+            ResponseCacheMiddleware,
+            routes=Config.RESPONSE_CACHE_ROUTES,
+            roles=Config.RESPONSE_CACHE_ROLES,
+            ttl=Config.RESPONSE_CACHE_TTL,
+        )
+
     @app.middleware("http")
     async def custom_logging(req: Request, call_next):
-        start_time = time.time()
+        start_time = time.perf_counter()
+
+        ctx = RequestContext(method=req.method, path=req.url.path, scope=req.scope)
+        token = request_context.set(ctx)
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            response = await call_next(req)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            request_context.reset(token)
+        processing_time = time.perf_counter() - start_time
+
+        route = req.scope.get("route")
+        # the template, not the path, keeps the label set bounded
+        REQUEST_LATENCY.observe(processing_time, req.method, getattr(route, "path", "unmatched"), str(response.status_code))
 
-        response = await call_next(req)
-        processing_time = time.time() - start_time
+        rate_limit = getattr(req.state, "rate_limit", None)
+        if rate_limit is not None:
+            response.headers.update(rate_limit.headers())
 
-        message = f"{getattr(req.client, 'host', 'unknown')}:{getattr(req.client, 'port', 'unknown')} — {req.method} — {req.url.path} — {response.status_code} completed after {processing_time}s"
+        if Config.ENVIRONMENT != "production":
+            response.headers["X-DB-Queries"] = str(ctx.db_queries)
+            response.headers["Server-Timing"] = server_timing(ctx, processing_time)
 
-        print(message)
+        # successful requests are sampled, errors and slow requests are always logged
+        if response.status_code < 400 and processing_time * 1000 < Config.ACCESS_LOG_SLOW_MS and random.random() >= Config.ACCESS_LOG_SAMPLE_RATE:
+            return response
+
+        verified_token = getattr(req.state, "verified_token", None)
+
+        access_logger.info({
+            "client": f"{getattr(req.client, 'host', 'unknown')}:{getattr(req.client, 'port', 'unknown')}",
+            "method": req.method,
+            "path": req.url.path,
+            "route": getattr(route, "path", None),
+            "status": response.status_code,
+            "duration_ms": round(processing_time * 1000, 3),
+            "user_id": verified_token[1].get("user", {}).get("user_uid") if verified_token else None,
+            "db_queries": ctx.db_queries,
+            "response_size": int(response.headers["content-length"]) if "content-length" in response.headers else None,
+        })
         return response
 
     app.add_middleware(
@@ -33,4 +183,3 @@ def register_middleware(app: FastAPI):
         TrustedHostMiddleware,
         allowed_hosts=["localhost", "127.0.0.1"],
     )
-
@@ -0,0 +1,138 @@
+import asyncio, logging
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Tuple
+from sqlmodel import or_, select
+from src.config import Config
+from src.db.main import async_session
+from src.db.models import OutboxMessage
+from src.metrics import CELERY_ENQUEUE_LATENCY
+
+
+def outbox_message(task_name: str, *args: Any, **kwargs: Any) -> OutboxMessage:
+    """Build an outbox row for `task_name(*args, **kwargs)`, to be added to the caller's session"""
+    return OutboxMessage(task_name=task_name, payload={"args": list(args), "kwargs": kwargs})
+
+
+class OutboxRelay:
+    """
+    Moves outbox rows to the broker in batches, in the background of each API worker.
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several workers can relay side by side
+    without picking up the same rows, and are deleted once the broker has accepted them.
+
+    A row the broker refuses is retried with exponential backoff, behind the rows that have not failed yet.
+    After `max_attempts` failures it is parked: it stays in the table, dead-lettered, until someone resets
+    its `attempts` to 0.
+    """
+    def __init__(self, batch_size: int, interval: float, max_attempts: int, retry_delay: float, max_retry_delay: float) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox-relay")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self) -> None:
+        """Relay right away instead of at the next poll, called after committing new rows"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                relayed = await self.relay_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning("Outbox relay failed: %s", e)
+                relayed = 0
+
+            if relayed == self.batch_size:
+                continue  # a full batch, there is probably more waiting
+
+            assert self._wakeup is not None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def relay_batch(self) -> int:
+        async with async_session() as session:
+            statement = (
+                select(OutboxMessage)
+                .where(OutboxMessage.attempts < self.max_attempts)
+                .where(or_(OutboxMessage.next_attempt_at.is_(None), OutboxMessage.next_attempt_at <= datetime.now()))
+                .order_by(OutboxMessage.attempts, OutboxMessage.created_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            messages = (await session.exec(statement)).all()
+            if not messages:
+                return 0
+
+            calls = [(msg.task_name, msg.payload, msg.idempotency_key) for msg in messages]
+            published = await asyncio.to_thread(self._publish, calls)
+
+            for message in messages[:published]:
+                await session.delete(message)
+            if published < len(messages):
+                self.failed(messages[published])
+
+            await session.commit()
+            return published
+
+    def failed(self, message: OutboxMessage) -> None:
+        message.attempts += 1
+        if message.attempts >= self.max_attempts:
+            logging.error("Outbox message %r parked after %d failed relays", message, message.attempts)
+            return
+        delay = min(self.retry_delay * 2 ** (message.attempts - 1), self.max_retry_delay)
+        message.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+
+    def _publish(self, calls: List[Tuple[str, dict, str]]) -> int:
+        """Publish over one broker connection, stops at the first failure and returns how many went out"""
+        from src.celery_task import c_app
+
+        published = 0
+        try:
+            with c_app.producer_or_acquire() as producer:
+                for task_name, payload, idempotency_key in calls:
+                    with CELERY_ENQUEUE_LATENCY.time(task_name):
+                        c_app.send_task(
+                            task_name,
+                            args=payload.get("args", []),
+                            kwargs=payload.get("kwargs", {}),
+                            task_id=idempotency_key,
+                            producer=producer,
+                            ignore_result=True,
+                            retry=False,
+                            timeout=Config.CELERY_PUBLISH_TIMEOUT,
+                        )
+                    published += 1
+        except Exception as e:
+            logging.warning("Relaying outbox messages to the broker failed: %s", e)
+        return published
+
+
+outbox_relay = OutboxRelay(
+    batch_size=Config.OUTBOX_BATCH_SIZE,
+    interval=Config.OUTBOX_POLL_INTERVAL,
+    max_attempts=Config.OUTBOX_MAX_ATTEMPTS,
+    retry_delay=Config.OUTBOX_RETRY_DELAY,
+    max_retry_delay=Config.OUTBOX_MAX_RETRY_DELAY,
+)
@@ -0,0 +1,128 @@
+import asyncio, math, time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Tuple
+from fastapi import Request
+from src.config import Config
+from src.db.redis import redis_client
+from src.errors import RateLimitExceeded, RedisUnavailable
+from src.metrics import RATE_LIMITED, REDIS_LATENCY
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# GCRA: one key per client holding its theoretical arrival time (TAT) in ms, Redis' clock keeps workers consistent.
+# A request is allowed when the TAT, pushed one emission interval ahead, stays within a period of now.
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = clock[1] * 1000 + math.floor(clock[2] / 1000)
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local new_tat = tat + interval
+if new_tat - now > period then
+    return {0, 0, new_tat - now - period, tat - now}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', new_tat - now)
+return {1, math.floor((period - (new_tat - now)) / interval), 0, new_tat - now}
+"""
+
+
+@lru_cache(maxsize=None)
+def gcra():
+    # registered on first use, so importing this module creates no Redis client
+    return redis_client.client.register_script(GCRA_SCRIPT)
+
+
+def parse_rate(rate: str) -> Tuple[int, int]:
+    """'5/minute' -> (5, 60000): requests and period in ms"""
+    count, _, period = rate.partition("/")
+    return int(count), PERIODS[period.strip()] * 1000
+
+
+@dataclass(slots=True)
+class RateLimitResult:
+    limit: int
+    period: int        # ms
+    allowed: bool
+    remaining: int
+    retry_after: int   # ms until the next request would be allowed
+    reset: int         # ms until the full limit is available again
+
+    def headers(self) -> dict:
+        return {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(math.ceil(self.reset / 1000)),
+            "RateLimit-Policy": f"{self.limit};w={self.period // 1000}",
+        }
+
+
+class LocalGCRA:
+    """The same algorithm in process memory, used while Redis is unreachable. Limits then apply per worker"""
+
+    def __init__(self, max_keys: int = 10000) -> None:
+        self.max_keys = max_keys
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+
+    def hit(self, key: str, limit: int, period: int) -> RateLimitResult:
+        interval = period / limit
+        now = time.monotonic() * 1000
+        tat = max(self._tats.get(key, now), now)
+        new_tat = tat + interval
+        if new_tat - now > period:
+            return RateLimitResult(limit, period, False, 0, int(new_tat - now - period), int(tat - now))
+
+        self._tats[key] = new_tat
+        self._tats.move_to_end(key)
+        if len(self._tats) > self.max_keys:
+            self._tats.popitem(last=False)
+        return RateLimitResult(limit, period, True, int((period - (new_tat - now)) // interval), 0, int(new_tat - now))
+
+
+local_limiter = LocalGCRA()
+
+
+async def hit(key: str, limit: int, period: int) -> RateLimitResult:
+    # while the Redis circuit is open this fails at once and the worker counts locally
+    try:
+        with REDIS_LATENCY.time("gcra"):
+            allowed, remaining, retry_after, reset = await redis_client.execute(
+                lambda client: asyncio.wait_for(
+                    gcra()(keys=[key], args=[max(period // limit, 1), period], client=client), Config.RATE_LIMIT_REDIS_TIMEOUT
+                )
+            )
+    except RedisUnavailable:
+        return local_limiter.hit(key, limit, period)
+    return RateLimitResult(limit, period, bool(allowed), remaining, retry_after, reset)
+
+
+class RateLimiter:
+    """
+    Per-route limit, keyed by the user when the request carries a verified token and by client IP otherwise.
+    List it after the auth dependencies so the token is already verified:
+
+        @book_router.get("/", dependencies=[user_role_checker, Depends(RateLimiter("books", "120/minute"))])
+
+    The RateLimit-* headers are added by the access log middleware from `request.state.rate_limit`.
+    """
+
+    def __init__(self, scope: str, rate: str) -> None:
+        self.scope = scope
+        self.limit, self.period = parse_rate(rate)
+
+    async def __call__(self, request: Request) -> None:
+        if not Config.RATE_LIMIT_ENABLED:
+            return
+
+        verified = getattr(request.state, "verified_token", None)
+        if verified:
+            client = f"user:{verified[1]['user']['user_uid']}"
+        else:
+            client = f"ip:{getattr(request.client, 'host', 'unknown')}"
+
+        result = await hit(f"ratelimit:{self.scope}:{client}", self.limit, self.period)
+        request.state.rate_limit = result
+        if not result.allowed:
+            RATE_LIMITED.inc(self.scope)
+            raise RateLimitExceeded(math.ceil(result.retry_after / 1000))
@@ -0,0 +1,27 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(slots=True)
+class RequestContext:
+    """Per-request bookkeeping, filled in by the middleware, auth and db hooks while a request runs"""
+    method: str
+    path: str
+    # the ASGI scope, the router fills in the matched route once it has one
+    scope: Optional[dict] = None
+    db_queries: int = 0
+    db_time: float = 0.0
+
+    @property
+    def route(self) -> Optional[str]:
+        route = self.scope.get("route") if self.scope is not None else None
+        return getattr(route, "path", None)
+
+
+# holds a mutable object rather than values, so tasks spawned while handling the request update the same one
+request_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+def current_request() -> Optional[RequestContext]:
+    return request_context.get()
@@ -0,0 +1,116 @@
+from typing import Dict, List, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode
+from src.auth.utils import decode_token
+from src.cache import MISSING, Cache
+from src.config import Config
+from src.db.redis import token_revoked
+from src.responses import MSGPACK_MEDIA_TYPES, msgpack
+
+# routes under these prefixes answer per user and must never be shared
+UNCACHEABLE_PREFIXES = ("/v2/auth/",)
+
+response_cache = Cache("response", ttl=Config.RESPONSE_CACHE_TTL, local_ttl=min(Config.CACHE_LOCAL_TTL, Config.RESPONSE_CACHE_TTL))
+
+
+class ResponseCacheMiddleware:
+    """
+    Shares the JSON body of GET listings that are the same for every user of a role (`/v2/books/`, `/v2/review/`).
+    The key is the path, the sorted query string and the role claim of the access token, never the user.
+    Before answering from the cache the token is checked like the route would: signature, expiry, blocklist,
+    an access (not refresh) token of a verified user with one of `roles`. Anything else goes to the route.
+    Entries are tagged per route (`routes` maps path -> tag), the book and review writes invalidate the tags.
+    """
+
+    def __init__(self, app, routes: Dict[str, str], roles: Sequence[str], ttl: float) -> None:
+        for path in routes:
+            if path.startswith(UNCACHEABLE_PREFIXES):
+                raise ValueError(f"{path} answers per user and cannot go through the shared response cache")
+        self.app = app
+        self.routes = routes
+        self.roles = set(roles)
+        self.cache_control = f"private, max-age={int(ttl)}".encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        token, role = await self.authorize(scope, headers.get(b"authorization", b"").decode("latin-1"))
+        accept = headers.get(b"accept", b"").decode("latin-1")
+        # only JSON bodies are kept, MessagePack clients go to the route
+        if role is None or (msgpack is not None and any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)):
+            await self.app(scope, receive, send)
+            return
+
+        query = urlencode(sorted(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)))
+        key = f"{scope['path']}?{query}:{role}"
+
+        cached = await response_cache.get(key)
+        if cached is not MISSING:
+            body = cached["body"].encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": self.cache_headers(b"HIT") + [
+                    (b"content-type", cached["content_type"].encode("latin-1")),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        tags = [self.routes[scope["path"]]]
+        since = await response_cache.generations(tags)
+        # the route reuses the token verified here instead of checking it again
+        scope.setdefault("state", {})["verified_token"] = token
+
+        status = 500
+        content_type = ""
+        chunks: List[bytes] = []
+
+        async def send_and_keep(message):
+            nonlocal status, content_type
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"").decode("latin-1")
+                if status == 200:
+                    message["headers"] = [(name, value) for name, value in message.get("headers", []) if name != b"vary"] + self.cache_headers(b"MISS")
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        await self.app(scope, receive, send_and_keep)
+
+        if status == 200 and content_type.startswith("application/json"):
+            body = b"".join(chunks).decode("utf-8")
+            await response_cache.set(key, {"body": body, "content_type": content_type}, tags, since)
+
+    async def authorize(self, scope, authorization: str) -> Tuple[Tuple[str, dict] | None, str | None]:
+        """The verified token and its role when the request may be answered from the cache, else (None, None)"""
+        if not authorization.startswith("Bearer "):
+            return None, None
+        token = authorization[7:]
+
+        verified = scope.get("state", {}).get("verified_token")
+        if verified and verified[0] == token:
+            token_data = verified[1]
+        else:
+            token_data = decode_token(token)
+            if token_data is None:
+                return None, None
+            try:
+                if await token_revoked(token_data):
+                    return None, None
+            except Exception:
+                # let the route deal with it
+                return None, None
+
+        user = token_data.get("user", {})
+        if token_data.get("refresh") or not user.get("is_verified") or user.get("role") not in self.roles:
+            return None, None
+        return (token, token_data), user["role"]
+
+    def cache_headers(self, status: bytes) -> List[Tuple[bytes, bytes]]:
+        # private: bodies are only shared between users of the same role, never by shared proxies
+        return [(b"cache-control", self.cache_control), (b"vary", b"Authorization, Accept"), (b"x-cache", status)]
@@ -0,0 +1,106 @@
+import dataclasses, datetime, enum, uuid
+from typing import Any, List, Mapping, Optional, Sequence, Type
+import orjson
+from fastapi import Query
+from fastapi.requests import Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+from src.config import Config
+from src.errors import InvalidFields
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional, without it every client gets JSON
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+class FastJSONResponse(Response):
+    """
+    Serializes with orjson, which handles datetimes, UUIDs, enums and slotted dataclasses natively.
+    Meant for read-only rows such as `BookRow`: returning a Response skips FastAPI's response_model
+    validation, so the route is trusted to send the documented fields.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default)
+
+
+class MsgPackResponse(Response):
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, default=_msgpack_default, use_bin_type=True)
+
+
+def _default(value: Any) -> Any:
+    # orjson covers the common types itself and only calls this for the rest
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, Mapping):
+        return dict(value)
+    if dataclasses.is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"Type is not MessagePack serializable: {type(value).__name__}")
+
+
+def wants_msgpack(request: Request) -> bool:
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def fast_response(request: Request, content: Any, fields: Optional[Sequence[str]] = None, status_code: int = 200) -> Response:
+    """
+    orjson by default, MessagePack when the client asks for it and msgpack is installed.
+    With `fields`, `content` is a list of rows and only those attributes are sent.
+    """
+    if fields is not None:
+        content = [{name: getattr(row, name) for name in fields} for row in content]
+    response_class = MsgPackResponse if wants_msgpack(request) else FastJSONResponse
+    response = response_class(content, status_code=status_code)
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def listing_response(request: Request, rows: Sequence[Any], fields: Optional[Sequence[str]] = None) -> Any:
+    """
+    The rows as they are, for FastAPI to validate against the route's response_model, unless the client
+    opted into the raw path with `fields=` or a MessagePack Accept type, or FAST_LISTINGS is on.
+    """
+    if fields is None and not wants_msgpack(request) and not Config.FAST_LISTINGS:
+        return rows
+    return fast_response(request, rows, fields)
+
+
+class FieldSelector:
+    """
+    The `fields=` query parameter of a listing, checked against its response schema:
+
+        fields: Optional[List[str]] = Depends(FieldSelector(BookSchema))
+
+    Resolves to the requested names in schema order, or None when the parameter is absent.
+    """
+    def __init__(self, schema: Type[BaseModel]) -> None:
+        self.allowed = list(schema.model_fields)
+
+    def __call__(self, fields: Optional[str] = Query(None, description="Comma separated fields to return, all of them by default")) -> Optional[List[str]]:
+        if fields is None:
+            return None
+        requested = {name.strip() for name in fields.split(",") if name.strip()}
+        if not requested or not requested.issubset(self.allowed):
+            raise InvalidFields()
+        return [name for name in self.allowed if name in requested]
@@ -1,11 +1,13 @@
-from .schema import ReviewCreateModel
+from .schema import ReviewCreateModel, ReviewModel
 from .service import ReviewService
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from typing import List, Optional
 from sqlmodel.ext.asyncio.session import AsyncSession
 from src.db.models import User
 from src.db.main import get_session
 from src.auth.dependencies import RoleChecker, get_current_user
 from src.errors import BookNotFound
+from src.responses import FieldSelector, fast_response, listing_response
 
 
 review_service = ReviewService()
@@ -14,17 +16,17 @@ admin_role_checker = Depends(RoleChecker(["admin"]))
 user_role_checker = Depends(RoleChecker(["admin", "user"]))
 
 
-@review_router.get("/", dependencies=[user_role_checker])
-async def get_all_reviews(session:AsyncSession = Depends(get_session)):
-    books = await review_service.get_all_reviews(session)
-    return books
+@review_router.get("/", response_model=List[ReviewModel], dependencies=[user_role_checker])
+async def get_all_reviews(request: Request, fields: Optional[List[str]] = Depends(FieldSelector(ReviewModel)), session:AsyncSession = Depends(get_session)):
+    reviews = await review_service.get_all_review_rows(session, fields)
+    return listing_response(request, reviews, fields)
 
 @review_router.get("/book/{book_uid}", dependencies=[user_role_checker])
-async def get_review(review_uid:str, session: AsyncSession = Depends(get_session)):
-    book = await review_service.get_review(review_uid, session)
+async def get_review(request: Request, review_uid:str, session: AsyncSession = Depends(get_session)):
+    review = await review_service.get_review_row(review_uid, session)
 
-    if not book: raise BookNotFound()
-    return book
+    if not review: raise BookNotFound()
+    return fast_response(request, review)
 
 
 @review_router.post("/book/{book_uid}", dependencies=[user_role_checker])
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
+from dataclasses import dataclass
 from datetime import datetime
 import uuid
 
@@ -18,3 +19,14 @@ class ReviewModel(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+
+@dataclass(slots=True)
+class ReviewRow:
+    """Read-only review row for listings, columns left out by a `fields=` selection stay None"""
+    uid: Optional[str] = None
+    rating: Optional[int] = None
+    review_text: Optional[str] = None
+    user_uid: Optional[str] = None
+    book_uid: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
@@ -7,12 +7,18 @@ from src.errors import BookNotFound
 from src.auth.service import UserService
 from src.service import BookService
 from src.db.models import Review
-from .schema import ReviewCreateModel
+from src.cache import Cache, invalidate_tags
+from .schema import ReviewCreateModel, ReviewModel, ReviewRow
+from typing import AsyncIterator, List, Optional, Sequence
 
 
 book_service = BookService()
 user_service = UserService()
 
+REVIEW_COLUMNS = tuple(getattr(Review, name) for name in ReviewModel.model_fields)
+
+review_cache = Cache("review", decode=lambda data: ReviewRow(**data))
+
 
 class ReviewService:
     async def add_review_to_book(self, user_email:str, book_uid: str, review_data: ReviewCreateModel, session: AsyncSession):
@@ -36,6 +42,7 @@ class ReviewService:
 
             session.add(new_review)
             await session.commit()
+            await invalidate_tags("reviews")
             return new_review
 
         except Exception as e:
@@ -50,6 +57,14 @@ class ReviewService:
 
         return res.first()
 
+    @review_cache.cached(key=lambda self, review_uid, session: review_uid, tags=lambda self, review_uid, session: [f"review:{review_uid}"])
+    async def get_review_row(self, review_uid: str, session: AsyncSession) -> Optional[ReviewRow]:
+        res = await session.execute(self.review_rows_statement().where(Review.uid == review_uid))
+
+        row = res.first()
+
+        return ReviewRow(**row._mapping) if row is not None else None
+
     async def get_all_reviews(self, session:AsyncSession):
         stmt = select(Review).order_by(desc(Review.created_at))
 
@@ -57,6 +72,21 @@ class ReviewService:
 
         return res.all()
 
+    def review_rows_statement(self, fields: Optional[Sequence[str]] = None):
+        columns = REVIEW_COLUMNS if fields is None else [getattr(Review, name) for name in fields]
+        return select(*columns).order_by(desc(Review.created_at))
+
+    async def get_all_review_rows(self, session: AsyncSession, fields: Optional[Sequence[str]] = None) -> List[ReviewRow]:
+        res = await session.execute(self.review_rows_statement(fields))
+
+        return [ReviewRow(**row._mapping) for row in res]
+
+    async def iter_review_rows(self, session: AsyncSession, fields: Optional[Sequence[str]] = None, chunk_size: int = 1000) -> AsyncIterator[ReviewRow]:
+        res = await session.stream(self.review_rows_statement(fields).execution_options(yield_per=chunk_size))
+
+        async for row in res:
+            yield ReviewRow(**row._mapping)
+
 
     async def delete_review(self, review_uid: str, user_email: str, session: AsyncSession):
 
@@ -70,6 +100,7 @@ class ReviewService:
 
         await session.delete(review)
         await session.commit()
+        await invalidate_tags(f"review:{review_uid}", "reviews")
 
         
 
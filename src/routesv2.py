@@ -1,21 +1,27 @@
-from fastapi import APIRouter, status, Depends
+from fastapi import APIRouter, status, Depends, Request
 from fastapi.exceptions import HTTPException
 from starlette.status import HTTP_200_OK, HTTP_201_CREATED
 from src.reviews.routes import admin_role_checker
 from src.schema import Book, BookUpdate, BookCreate, BookDetailModel
+from src.schema import Book as BookSchema
 from sqlmodel.ext.asyncio.session import AsyncSession
-from src.service import BookService
+from src.service import BookService, book_flight
 from src.db.main import get_session
-from typing import List
+from typing import List, Optional
 from src.db.models import Book
 from src.auth.dependencies import AccessTokenBearer, RoleChecker
 from src.errors import BookNotFound
+from src.responses import FieldSelector, fast_response, listing_response
+from src.rate_limit import RateLimiter
+from src.config import Config
 
 book_router = APIRouter()
 book_service = BookService()
 access_token_bearer = AccessTokenBearer()
 admin_role_checker = Depends(RoleChecker(["admin"]))
 user_role_checker = Depends(RoleChecker(["admin", "user"]))
+# after the role check, so it is counted per user
+books_rate_limit = Depends(RateLimiter("books", Config.RATE_LIMIT_BOOKS))
 
 
 @book_router.post("/", status_code=HTTP_201_CREATED, response_model=Book, dependencies=[user_role_checker])
@@ -26,21 +32,21 @@ async def create_a_book(book_data: BookCreate,session: AsyncSession = Depends(ge
     return new_book
 
 
-@book_router.get("/", response_model=List[Book], dependencies=[user_role_checker])
-async def get_all_books(session: AsyncSession = Depends(get_session), token_details=Depends(access_token_bearer)):
-    print(token_details)
-    books = await book_service.get_all_books(session)
-    return books
+@book_router.get("/", response_model=List[Book], dependencies=[user_role_checker, books_rate_limit])
+async def get_all_books(request: Request, fields: Optional[List[str]] = Depends(FieldSelector(BookSchema)), session: AsyncSession = Depends(get_session), token_details=Depends(access_token_bearer)):
+    books = await book_service.get_all_book_rows(session, fields)
+    return listing_response(request, books, fields)
 
 
 
 @book_router.get("/{book_uid}", response_model=Book, dependencies=[user_role_checker])
-async def get_book(book_uid: str, session: AsyncSession = Depends(get_session), token_details=Depends(access_token_bearer)) -> Book:
-    
-    book = await book_service.get_book(book_uid, session)
+async def get_book(request: Request, book_uid: str, session: AsyncSession = Depends(get_session), token_details=Depends(access_token_bearer)) -> Book:
+
+    # concurrent requests for the same book share one query
+    book = await book_flight.do(book_uid, lambda: book_service.get_book_row(book_uid, session))
 
     if book:
-        return book
+        return fast_response(request, book)
     else:
         raise BookNotFound()
 
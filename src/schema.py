@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field, field_validator
 from typing import Annotated, Optional, List
+from dataclasses import dataclass
 import uuid
 from datetime import datetime
 from src.db.models import LanguageEnum
@@ -41,3 +42,18 @@ class BookCreate(BaseModel):
 class BookDetailModel(Book):
     reviews: List[ReviewModel]
     # tags:List[TagModel]
+
+
+@dataclass(slots=True)
+class BookRow:
+    """
+    Read-only book row for listings, the same fields as `Book` without pydantic or ORM state.
+    Columns left out by a `fields=` selection stay None.
+    """
+    uid: Optional[str] = None
+    title: Optional[str] = None
+    author: Optional[str] = None
+    year: Optional[str] = None
+    language: Optional[LanguageEnum] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
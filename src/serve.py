@@ -0,0 +1,153 @@
+"""
+Production entry point: a prefork server running the app in several uvicorn workers.
+
+The app is imported once, in the master, before the workers are forked, so they share its code and
+module state pages copy-on-write instead of each importing everything again. The listening socket is
+opened by the master too and inherited by every worker; the kernel spreads the connections between them.
+The master restarts workers that die and, on SIGTERM/SIGINT, gives them SERVER_GRACEFUL_TIMEOUT seconds
+to finish their requests.
+
+    python -m src.serve --workers 4 --port 8000
+
+Host, port, workers, backlog and keep-alive default to the SERVER_* settings. Nothing may open a connection
+or start a thread at import time, the lifespan does that in each worker.
+"""
+import argparse, gc, importlib.util, logging, os, signal, socket, sys, time
+from typing import Dict
+import uvicorn
+from src.config import Config
+
+# imported by the API on first use rather than by `import src`, the workers inherit them from the master instead
+PRELOAD = ("src.celery_task", "itsdangerous")
+
+# a worker dying sooner than this after its start is not restarted right away, so a crash loop cannot spin
+MIN_WORKER_UPTIME = 1.0
+
+
+def server_config(app, args: argparse.Namespace) -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        # blocking call detection (LOOP_DEBUG) hooks into asyncio's own loop
+        loop="uvloop" if importlib.util.find_spec("uvloop") and not Config.LOOP_DEBUG else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keepalive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        # the access log middleware already writes one JSON line per request
+        access_log=False,
+        proxy_headers=True,
+        lifespan="on",
+    )
+
+
+def bind(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    def __init__(self, config: uvicorn.Config, sock: socket.socket, workers: int, graceful_timeout: float) -> None:
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children: Dict[int, float] = {}    # pid -> start time
+        self.stopping = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # the worker: its own event loop and signal handlers, serving the inherited socket
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                uvicorn.Server(self.config).run(sockets=[self.sock])
+            except BaseException:
+                logging.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def stop(self, signum, frame) -> None:
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        logging.warning("Serving on %s with %d workers (loop=%s, http=%s)",
+                        self.sock.getsockname(), self.workers, self.config.loop, self.config.http)
+
+        deadline = None
+        while self.children:
+            if self.stopping and deadline is None:
+                deadline = time.monotonic() + self.graceful_timeout
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in self.children:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+
+            started = self.children.pop(pid, None)
+            if self.stopping or started is None:
+                continue
+            logging.warning("Worker %d exited with status %d, starting a new one", pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < MIN_WORKER_UPTIME:
+                time.sleep(MIN_WORKER_UPTIME)
+            if not self.stopping:
+                self.spawn()
+        self.sock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the Booklynn API with several workers")
+    parser.add_argument("--host", default=Config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=Config.SERVER_WORKERS or os.cpu_count() or 1)
+    parser.add_argument("--backlog", type=int, default=Config.SERVER_BACKLOG)
+    parser.add_argument("--keepalive", type=int, default=Config.SERVER_KEEPALIVE)
+    parser.add_argument("--graceful-timeout", type=float, default=Config.SERVER_GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+
+    # preload: every worker starts from the master's imported app
+    from src import app
+    for module in PRELOAD:
+        importlib.import_module(module)
+
+    config = server_config(app, args)
+    sock = bind(args.host, args.port, args.backlog)
+
+    if args.workers == 1 or not hasattr(os, "fork"):
+        # a single process, or Windows where there is no fork
+        uvicorn.Server(config).run(sockets=[sock])
+        return
+
+    # objects created while importing survive in every worker, keep the collector from touching (and copying) them
+    gc.collect()
+    gc.freeze()
+    Master(config, sock, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
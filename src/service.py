@@ -1,10 +1,21 @@
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlmodel import desc, select
 from src.db.models import Book
-from src.schema import BookCreate, BookUpdate
+from src.schema import Book as BookSchema, BookCreate, BookRow, BookUpdate
+from src.cache import Cache, invalidate_tags
+from src.single_flight import SingleFlight
 from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence
 import uuid
 
+# the columns behind the Book response schema, selected without building ORM objects
+BOOK_COLUMNS = tuple(getattr(Book, name) for name in BookSchema.model_fields)
+
+# rows read back from Redis hold the JSON forms of their values (ISO datetimes, enum values), which serialize the same
+book_cache = Cache("book", decode=lambda data: BookRow(**data))
+# concurrent reads of one book, across workers too; a write drops the result it published with the book's cache entries
+book_flight = SingleFlight("get_book", decode=lambda data: BookRow(**data) if data else None)
+
 
 class BookService:
     """
@@ -15,6 +26,21 @@ class BookService:
         result = await session.execute(statement)
         return result.scalars().all()
 
+    def book_rows_statement(self, fields: Optional[Sequence[str]] = None):
+        columns = BOOK_COLUMNS if fields is None else [getattr(Book, name) for name in fields]
+        return select(*columns).order_by(desc(Book.created_at))
+
+    async def get_all_book_rows(self, session: AsyncSession, fields: Optional[Sequence[str]] = None) -> List[BookRow]:
+        # read-only listing: only the requested columns, as slotted rows the session never tracks
+        result = await session.execute(self.book_rows_statement(fields))
+        return [BookRow(**row._mapping) for row in result]
+
+    async def iter_book_rows(self, session: AsyncSession, fields: Optional[Sequence[str]] = None, chunk_size: int = 1000) -> AsyncIterator[BookRow]:
+        # same rows, fetched `chunk_size` at a time for listings too big to hold at once
+        result = await session.stream(self.book_rows_statement(fields).execution_options(yield_per=chunk_size))
+        async for row in result:
+            yield BookRow(**row._mapping)
+
     # async def create_book(self, book_data: BookCreate, session:AsyncSession):
     #     # Create a new book
     #     # Args -> book_data (BookCreateModel): data to create a new
@@ -34,6 +60,12 @@ class BookService:
 
     #     return new_book
 
+    @book_cache.cached(key=lambda self, book_uid, session: book_uid, tags=lambda self, book_uid, session: [f"book:{book_uid}"])
+    async def get_book_row(self, book_uid: str, session: AsyncSession) -> Optional[BookRow]:
+        result = await session.execute(self.book_rows_statement().where(Book.uid == book_uid))
+        row = result.first()
+        return BookRow(**row._mapping) if row is not None else None
+
     async def get_book(self, book_uid: str, session: AsyncSession):
         stmt = select(Book).where(Book.uid == book_uid)
         res = await session.execute(stmt)
@@ -56,6 +88,7 @@ class BookService:
             
             book_to_update.updated_at = datetime.now()
             await session.commit()
+            await invalidate_tags(f"book:{book_uid}", "books", keys=book_flight.remote_keys(book_uid))
             return book_to_update
         
         else: 
@@ -68,6 +101,7 @@ class BookService:
         if book_to_del is not None:
             await session.delete(book_to_del)
             await session.commit()
+            await invalidate_tags(f"book:{book_uid}", "books", keys=book_flight.remote_keys(book_uid))
             return {}
         
         else: 
@@ -94,5 +128,7 @@ class BookService:
         new_book.user_uid = str(user_uid) if user_uid else None
         session.add(new_book)
         await session.commit()
+        # a cached "not found" for this uid cannot exist, the listings can
+        await invalidate_tags("books")
         return new_book
 
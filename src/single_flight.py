@@ -0,0 +1,103 @@
+import asyncio, logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import orjson
+from src.config import Config
+from src.db.redis import redis_client
+from src.metrics import SINGLE_FLIGHT, REDIS_LATENCY
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent reads: while a call for `key` is running in this worker, other callers
+    await it and share its result instead of running their own. The call runs in the first caller, with its
+    session, so waiting requests do not hold a second connection each. Its result must be safe to share
+    between requests, e.g. a `BookRow` rather than an ORM instance. If the first caller goes away (client
+    disconnect) a waiting caller takes over.
+
+    With `decode`, callers in other workers coalesce too: the worker that takes the Redis lock runs the call
+    and publishes the result as JSON for `result_ttl` seconds, the others wait for it (up to the lock's TTL)
+    and fall back to running the call themselves if it does not show up or Redis fails.
+    """
+
+    def __init__(self, name: str, decode: Optional[Callable[[Any], Any]] = None,
+                 lock_ttl: float = Config.SINGLE_FLIGHT_LOCK_TTL, result_ttl: float = Config.SINGLE_FLIGHT_RESULT_TTL) -> None:
+        self.name = name
+        self.decode = decode
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while (call := self._calls.get(key)) is not None:
+            SINGLE_FLIGHT.inc(self.name, "hit")
+            try:
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                if not call.cancelled():
+                    raise
+
+        SINGLE_FLIGHT.inc(self.name, "miss")
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await (self._remote(key, fn) if self.decode is not None and Config.SINGLE_FLIGHT_REDIS else fn())
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as e:
+            call.set_exception(e)
+            # retrieved here, so a call nobody waited on is not reported as an unhandled error
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def remote_keys(self, key: Hashable) -> Tuple[str, str]:
+        """The Redis lock and result keys of `key`, to delete along with the cache entries a write invalidates"""
+        return f"singleflight:{self.name}:{key}:lock", f"singleflight:{self.name}:{key}:result"
+
+    async def _remote(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        lock_key, result_key = self.remote_keys(key)
+        try:
+            with REDIS_LATENCY.time("set"):
+                leader = await redis_client.execute(lambda client: client.set(lock_key, "", nx=True, px=int(self.lock_ttl * 1000)))
+        except Exception as e:
+            logging.warning("Single flight %s without Redis: %s", self.name, e)
+            return await fn()
+
+        if leader:
+            try:
+                result = await fn()
+            except Exception:
+                # let the waiting workers run the call themselves rather than wait out the lock
+                await asyncio.gather(redis_client.execute(lambda client: client.delete(lock_key)), return_exceptions=True)
+                raise
+            async def publish(client):
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.set(result_key, orjson.dumps(result), px=int(self.result_ttl * 1000))
+                    pipe.delete(lock_key)
+                    await pipe.execute()
+
+            try:
+                with REDIS_LATENCY.time("pipeline"):
+                    await redis_client.execute(publish)
+            except Exception as e:
+                logging.warning("Single flight %s could not publish its result: %s", self.name, e)
+            return result
+
+        # another worker is running the call, wait for the result it publishes
+        deadline = asyncio.get_running_loop().time() + self.lock_ttl
+        try:
+            while asyncio.get_running_loop().time() < deadline:
+                with REDIS_LATENCY.time("get"):
+                    data = await redis_client.execute(lambda client: client.get(result_key))
+                if data is not None:
+                    SINGLE_FLIGHT.inc(self.name, "remote_hit")
+                    return self.decode(orjson.loads(data))
+                await asyncio.sleep(Config.SINGLE_FLIGHT_POLL_INTERVAL)
+        except Exception as e:
+            logging.warning("Single flight %s without Redis: %s", self.name, e)
+        return await fn()
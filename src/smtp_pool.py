@@ -0,0 +1,183 @@
+import logging, queue, smtplib, ssl, threading, time
+from contextlib import contextmanager
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from src.config import Config
+
+
+def build_message(recipients: List[str], subject: str, body: str) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = formataddr((Config.MAIL_FROM_NAME, Config.MAIL_FROM))
+    message["To"] = ", ".join(recipients)
+    message["Subject"] = subject
+    message["Message-ID"] = make_msgid()
+    message.set_content(body, subtype="html")
+    return message
+
+
+class SMTPConnectionPool:
+    """
+    Keeps authenticated SMTP sessions open across the tasks of a worker process, so a message
+    doesn't pay for a TCP connect, STARTTLS and login each time.
+    Idle sessions are checked with NOOP before reuse and reopened when the server has dropped them.
+    """
+    def __init__(self, host: str, port: int, username: str = "", password: str = "", starttls: bool = True,
+                 ssl_tls: bool = False, use_credentials: bool = True, validate_certs: bool = True,
+                 max_size: int = 2, keepalive: float = 30.0, timeout: float = 10.0, max_messages: int = 100) -> None:
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.ssl_tls = ssl_tls
+        self.use_credentials = use_credentials
+        self.validate_certs = validate_certs
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.max_messages = max_messages
+        # (connection, last used, messages sent on it)
+        self._idle: "queue.LifoQueue[Tuple[smtplib.SMTP, float, int]]" = queue.LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _ssl_context(self) -> ssl.SSLContext:
+        context = ssl.create_default_context()
+        if not self.validate_certs:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.ssl_tls:
+            conn: smtplib.SMTP = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout, context=self._ssl_context())
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                conn.starttls(context=self._ssl_context())
+        if self.use_credentials and self.username:
+            conn.login(self.username, self.password)
+        with self._lock:
+            self.connects += 1
+        return conn
+
+    def _close(self, conn: smtplib.SMTP) -> None:
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def _alive(self, conn: smtplib.SMTP, last_used: float) -> bool:
+        if time.monotonic() - last_used < self.keepalive:
+            return True
+        try:
+            return conn.noop()[0] == 250
+        except OSError:  # smtplib errors are OSErrors too
+            return False
+
+    def _acquire(self) -> Tuple[smtplib.SMTP, int]:
+        while True:
+            try:
+                conn, last_used, sent = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(), 0
+            if self._alive(conn, last_used):
+                return conn, sent
+            conn.close()
+
+    def _release(self, conn: smtplib.SMTP, sent: int) -> None:
+        if sent >= self.max_messages:
+            # providers cap messages per session, start a fresh one before they drop us
+            self._close(conn)
+            return
+        try:
+            self._idle.put_nowait((conn, time.monotonic(), sent))
+        except queue.Full:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        conn, sent = self._acquire()
+        try:
+            yield conn
+        except smtplib.SMTPResponseException:
+            # the server answered, so the session itself is still usable
+            self._release(conn, sent + 1)
+            raise
+        except OSError:
+            conn.close()
+            raise
+        else:
+            self._release(conn, sent + 1)
+
+    def send(self, message: EmailMessage) -> None:
+        try:
+            with self.connection() as conn:
+                conn.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # the pooled session went away between the NOOP check and now, retry once on a new one
+            with self.connection() as conn:
+                conn.send_message(message)
+
+    def send_many(self, messages: Iterable[EmailMessage], on_sent: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Send messages over as few sessions as possible, returns how many were accepted.
+        `on_sent(index)` is called for each accepted message as it goes, so a caller still knows what went out
+        when a later connect fails and the exception ends the call.
+        """
+        sent = 0
+        conn: Optional[smtplib.SMTP] = None
+        count = 0
+        try:
+            for index, message in enumerate(messages):
+                for attempt in range(2):
+                    if conn is None:
+                        conn, count = self._acquire()
+                    try:
+                        conn.send_message(message)
+                        sent += 1
+                        count += 1
+                        if on_sent is not None:
+                            on_sent(index)
+                        break
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                        # rejected by the server, the session is fine and the next message can go
+                        logging.warning("Sending to %s failed: %s", message["To"], e)
+                        break
+                    except OSError as e:
+                        conn.close()
+                        conn = None
+                        if attempt:
+                            logging.warning("Sending to %s failed: %s", message["To"], e)
+
+                if conn is not None and count >= self.max_messages:
+                    self._close(conn)
+                    conn = None
+        finally:
+            if conn is not None:
+                self._release(conn, count)
+        return sent
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn, _, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
+
+
+smtp_pool = SMTPConnectionPool(
+    host=Config.MAIL_SERVER,
+    port=Config.MAIL_PORT,
+    username=Config.MAIL_USERNAME,
+    password=Config.MAIL_PASSWORD.get_secret_value(),
+    starttls=Config.MAIL_STARTTLS,
+    ssl_tls=Config.MAIL_SSL_TLS,
+    use_credentials=Config.USE_CREDENTIALS,
+    validate_certs=Config.VALIDATE_CERTS,
+    max_size=Config.MAIL_POOL_SIZE,
+    keepalive=Config.MAIL_KEEPALIVE,
+    timeout=Config.MAIL_TIMEOUT,
+    max_messages=Config.MAIL_MAX_MESSAGES_PER_CONNECTION,
+)
@@ -0,0 +1,70 @@
+import os, tempfile
+
+# settings are read when src is imported, so they go into the environment first
+_db = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db}"
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("MAIL_FROM", "test@example.com")
+# a cached response has no X-DB-Queries to check
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+import httpx
+import pytest
+from sqlmodel import SQLModel
+import src
+from src.auth.routes import access_token_claims
+from src.auth.utils import create_access_token, generate_password_hash
+from src.db.main import async_engine, async_session, initdb
+from src.db.models import Book, Review, User
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def session():
+    await initdb()
+    async with async_session() as session:
+        yield session
+    async with async_engine.begin() as connection:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            await connection.execute(table.delete())
+    await async_engine.dispose()
+
+
+@pytest.fixture
+async def user(session) -> User:
+    user = User(username="reader", first_name="Test", email="reader@example.com",
+                role="user", is_verified=True, password_hash=generate_password_hash("password"))
+    session.add(user)
+    await session.commit()
+    return user
+
+
+@pytest.fixture
+async def books(session, user) -> list:
+    """Three books with two reviews each"""
+    books = [Book(title=f"Book {i}", author="Author", year="1999", language="English", user_uid=user.uid) for i in range(3)]
+    session.add_all(books)
+    await session.commit()
+    session.add_all(Review(rating=4, review_text="Good", user_uid=user.uid, book_uid=book.uid) for book in books for _ in range(2))
+    await session.commit()
+    return books
+
+
+@pytest.fixture
+def auth(user, monkeypatch) -> dict:
+    # no Redis here, nothing is revoked
+    async def token_revoked(token_data):
+        return False
+    monkeypatch.setattr("src.auth.dependencies.token_revoked", token_revoked)
+    token = create_access_token(access_token_claims(user))
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+async def client():
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=src.app), base_url="http://localhost") as client:
+        yield client
@@ -0,0 +1,8 @@
+from benchmarks.import_time import BUDGET, import_times, problems, total_us
+
+
+def test_import_time_budget():
+    # best of three fresh interpreters, the first one mostly measures a cold disk cache
+    runs = [import_times("src") for _ in range(3)]
+    best = min(runs, key=lambda entries: total_us(entries, "src"))
+    assert problems(best, "src", BUDGET) == []
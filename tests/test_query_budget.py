@@ -0,0 +1,23 @@
+import pytest
+from src.db.instrumentation import assert_query_budget, query_budget
+from src.schema import BookDetailModel
+from src.service import BookService
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_book_listing_budget(client, auth, books):
+    # the user behind the token with its selectin-loaded books, their reviews and the user's reviews,
+    # then the projected rows in one select; none of it grows with the number of books
+    response = await client.get("/v2/books/", headers=auth)
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == len(books)
+    assert_query_budget(response, 5)
+
+
+async def test_book_detail_serialization_budget(session, books):
+    # reviews are loaded with one selectin query for the book, not one per review
+    with query_budget(2, "book detail"):
+        book = await BookService().get_book(str(books[0].uid), session)
+        detail = BookDetailModel.model_validate(book, from_attributes=True)
+    assert len(detail.reviews) == 2